@@ -8,13 +8,34 @@ _base_dir_pathlib = Path(_base_dir)
 _results_dir_pathlib = _base_dir_pathlib / "results"
 _resources_dir_pathlib = _base_dir_pathlib / "resources"
 _tmp_dir_pathlib = _results_dir_pathlib / "tmp"
+_cache_dir_pathlib = _results_dir_pathlib / "cache"
 _ffmpeg_path = Path("/usr/local/bin/ffmpeg")
 _ffprobe_path = Path("/usr/local/bin/ffprobe")
 _default_font_path = Path("/System/Library/Fonts/SFNS.ttf")
+_arial_font_path = Path("/Library/fonts/Arial.ttf")
 _1_minute_timer_video_path = _resources_dir_pathlib / "1min_b&w_timer.mp4"
 
 _default_frame_rate = 30
+_default_frame_stack_size = 120
+_default_frame_prefetch_size = 32
+_default_frame_pipeline_queue_size = 32
+_default_ffmpeg_encoder_preset = "medium"
 _default_subtitle_height_percentage = 0.05
+# Video contact sheets, a grid of thumbnails previewing a whole video
+_default_contact_sheet_thumbnail_width = 320
+_default_contact_sheet_columns = 6
+_default_contact_sheet_max_thumbnails = 48
+# Raw frame store chunks, e.g. 40 frames of 1920x1080 BGR
+_frame_store_chunk_max_bytes = 256 * 1024 * 1024
+
+# Bounds for the font fitting engine in image_editor
+_max_font_size = 1000
+_font_pool_size = 64
+_font_fit_cache_size = 4096
+_text_sprite_cache_max_bytes = 64 * 1024 * 1024
+_qr_code_cache_size = 1024
+
+_default_img_writer_max_pending = 64
 
 _default_dpi = 300
 _printer_dpi = 1200
@@ -26,12 +47,12 @@ _a4_width_bleed_area_cm = 0.4
 _a4_pixel_width_bleed_area = int(_default_dpi * _a4_width_bleed_area_cm / 2.54)
 
 # For an A4 page, the size in pixels at 300dpi (without bleed area is (3508, 2480)
-# _a4_pixel_width_default_dpi = (
-#     int(_default_dpi * _a4_width_cm / 2.54) - _a4_pixel_width_bleed_area * 2
-# )
-# _a4_pixel_height_default_dpi = (
-#     int(_default_dpi * _a4_height_cm / 2.54) - _a4_pixel_width_bleed_area * 2
-# )
+_a4_pixel_width_default_dpi = (
+    int(_default_dpi * _a4_width_cm / 2.54) - _a4_pixel_width_bleed_area * 2
+)
+_a4_pixel_height_default_dpi = (
+    int(_default_dpi * _a4_height_cm / 2.54) - _a4_pixel_width_bleed_area * 2
+)
 
 
 _opencv_object_trackers = {
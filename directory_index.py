@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+from config import _cache_dir_pathlib
+
+_image_suffixes = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+_directory_manifests_dir_pathlib = _cache_dir_pathlib / "directory_manifests"
+_naming_indices = {}
+_naming_indices_lock = threading.Lock()
+
+
+class _DirectoryNamingIndex:
+    """In-memory index of the file names taken in a directory, built with a single scandir"""
+
+    def __init__(self, directory_path):
+        self.directory_path = directory_path
+        self.taken_file_names = set()
+        if directory_path.is_dir():
+            with os.scandir(directory_path) as entries:
+                self.taken_file_names.update(entry.name for entry in entries)
+        # Next suffix to try for every (stem, suffix) pair
+        self.next_counters = {}
+
+
+def reserve_unique_file_path(target_file_path):
+    """Find a free path for a new file and reserve it by atomically creating an empty file there.
+    If target_file_path is taken, a counter is appended to its stem (name_1.png, name_2.png...).
+    Names are allocated from an in-memory index of the directory, and the exclusive creation makes
+    concurrent threads or processes writing to the same directory never get the same path
+
+    :param target_file_path: Desired file path
+    :return: Path to the reserved (empty) file
+    """
+    target_file_path = Path(target_file_path)
+    directory_path = target_file_path.parent
+    stem, suffix = target_file_path.stem, target_file_path.suffix
+
+    with _naming_indices_lock:
+        naming_index = _get_naming_index(directory_path)
+
+        file_name = target_file_path.name
+        while True:
+            if file_name not in naming_index.taken_file_names:
+                try:
+                    file_descriptor = os.open(
+                        directory_path / file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY
+                    )
+                except FileExistsError:
+                    # Created by another process after the index was built
+                    pass
+                else:
+                    os.close(file_descriptor)
+                    naming_index.taken_file_names.add(file_name)
+                    return directory_path / file_name
+                naming_index.taken_file_names.add(file_name)
+
+            counter = naming_index.next_counters.get((stem, suffix), 1)
+            naming_index.next_counters[(stem, suffix)] = counter + 1
+            file_name = f"{stem}_{counter}{suffix}"
+
+
+def release_reserved_file_path(reserved_file_path):
+    """Delete a file reserved with reserve_unique_file_path and free its name, e.g. when writing it failed,
+    so no empty file is left behind
+
+    :param reserved_file_path: Path returned by reserve_unique_file_path
+    """
+    reserved_file_path = Path(reserved_file_path)
+    reserved_file_path.unlink(missing_ok=True)
+    with _naming_indices_lock:
+        naming_index = _naming_indices.get(reserved_file_path.parent.resolve())
+        if naming_index is not None:
+            naming_index.taken_file_names.discard(reserved_file_path.name)
+
+
+def forget_directory(directory_path):
+    """Drop the naming index of a directory, e.g. after files were deleted from it,
+    so the next reservation rebuilds it
+
+    :param directory_path: Path to directory
+    """
+    with _naming_indices_lock:
+        _naming_indices.pop(Path(directory_path).resolve(), None)
+
+
+def _get_naming_index(directory_path):
+    # Keyed on the resolved path, so relative and absolute paths to a directory share its index
+    resolved_directory_path = directory_path.resolve()
+    naming_index = _naming_indices.get(resolved_directory_path)
+    if naming_index is None:
+        naming_index = _DirectoryNamingIndex(directory_path)
+        _naming_indices[resolved_directory_path] = naming_index
+    return naming_index
+
+
+def natural_sort_key(file_name):
+    """Sorting key comparing the digit runs in a name as numbers, so frame_2.png goes before frame_10.png
+
+    :param file_name: File name
+    :return: Sorting key
+    """
+    return [
+        int(part) if part.isdigit() else part.lower()
+        for part in re.split(r"(\d+)", file_name)
+    ]
+
+
+def iter_files_in_dir(directory_path, suffixes=_image_suffixes):
+    """Iterate over the files in a directory with a given suffix, lazily as os.scandir finds them.
+    Files come in directory order, which is arbitrary, so only use it where the order doesn't matter.
+    For files in natural order, use list_files_in_dir
+
+    :param directory_path: Path to directory
+    :param suffixes: Tuple of accepted file suffixes (case insensitive), defaults to _image_suffixes
+    :return: Generator of file paths, unordered
+    """
+    directory_path = Path(directory_path)
+    suffixes = tuple(suffix.lower() for suffix in suffixes)
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(suffixes) and entry.is_file():
+                yield directory_path / entry.name
+
+
+def list_files_in_dir(directory_path, suffixes=_image_suffixes):
+    """List the files in a directory with a given suffix, in natural order. The listing is stored in an
+    on-disk manifest invalidated by the directory mtime, so listing an unchanged directory again only
+    takes a stat and a manifest read
+
+    :param directory_path: Path to directory
+    :param suffixes: Tuple of accepted file suffixes (case insensitive), defaults to _image_suffixes
+    :return: List of file paths
+    """
+    directory_path = Path(directory_path).resolve()
+    suffixes = sorted({suffix.lower() for suffix in suffixes})
+    directory_mtime_ns = directory_path.stat().st_mtime_ns
+
+    manifest_path = _directory_manifests_dir_pathlib / (
+        hashlib.sha1(
+            f"{directory_path}|{','.join(suffixes)}".encode("utf-8")
+        ).hexdigest()
+        + ".json"
+    )
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["directory_mtime_ns"] == directory_mtime_ns:
+            return [directory_path / file_name for file_name in manifest["file_names"]]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    file_names = sorted(
+        (path.name for path in iter_files_in_dir(directory_path, tuple(suffixes))),
+        key=natural_sort_key,
+    )
+    _write_manifest(
+        manifest_path,
+        {"directory_mtime_ns": directory_mtime_ns, "file_names": file_names},
+    )
+    return [directory_path / file_name for file_name in file_names]
+
+
+def list_all_pngs_in_dir(directory_path):
+    """List the PNG files in a directory, in natural order
+
+    :param directory_path: Path to directory
+    :return: List of file paths
+    """
+    return list_files_in_dir(directory_path, (".png",))
+
+
+def write_json_file_atomically(target_file_path, content):
+    """Write a JSON file through a temporary file renamed over the target, so concurrent readers
+    only ever see the previous or the new content, never a partial file
+
+    :param target_file_path: Path to JSON file, its directory is created if missing
+    :param content: JSON-serializable content
+    """
+    target_file_path = Path(target_file_path)
+    target_file_path.parent.mkdir(parents=True, exist_ok=True)
+    # Process and thread ids keep concurrent writers from sharing a temporary file
+    tmp_file_path = target_file_path.with_name(
+        f"{target_file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        with open(tmp_file_path, "w") as tmp_file:
+            json.dump(content, tmp_file)
+        os.replace(tmp_file_path, target_file_path)
+    except BaseException:
+        tmp_file_path.unlink(missing_ok=True)
+        raise
+
+
+def _write_manifest(manifest_path, manifest):
+    try:
+        write_json_file_atomically(manifest_path, manifest)
+    except OSError:
+        # The manifest is only a cache, listing still works without it
+        pass
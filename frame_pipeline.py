@@ -0,0 +1,234 @@
+import collections
+import itertools
+import queue
+import threading
+from concurrent import futures
+
+import cv2
+import numpy
+import tqdm
+
+import frame_store
+import image_editor
+import video_editor
+from config import _default_frame_pipeline_queue_size, _default_frame_stack_size
+
+_end_of_stream = object()
+
+
+class FrameStage:
+    """Transform applied to every frame of a pipeline by its own pool of workers. Frames leave the stage
+    in the order they came in, and at most max_pending_frames are queued in it"""
+
+    def __init__(
+        self,
+        function,
+        number_of_workers=1,
+        use_processes=False,
+        max_pending_frames=_default_frame_pipeline_queue_size,
+    ):
+        """
+        :param function: Function taking a BGR frame and returning the transformed frame, e.g. functools.partial(image_editor.insert_subtitle, text="Hello"). With use_processes, it must be picklable (a module-level function or a partial of one)
+        :param number_of_workers: Number of workers running the function, defaults to 1
+        :param use_processes: If True, workers are processes instead of threads, for transforms holding the GIL. Frames are then copied between processes. Defaults to False
+        :param max_pending_frames: Maximum number of frames queued or being transformed in the stage, defaults to _default_frame_pipeline_queue_size
+        """
+        self.function = function
+        self.number_of_workers = number_of_workers
+        self.use_processes = use_processes
+        self.max_pending_frames = max(max_pending_frames, number_of_workers)
+
+    def process(self, frames):
+        """Apply the stage to a stream of frames
+
+        :param frames: Iterable of frames
+        :return: Generator of transformed frames, in input order
+        """
+        executor_class = (
+            futures.ProcessPoolExecutor
+            if self.use_processes
+            else futures.ThreadPoolExecutor
+        )
+        frames = iter(frames)
+        with executor_class(max_workers=self.number_of_workers) as pool:
+            pending_frames = collections.deque(
+                pool.submit(self.function, frame)
+                for frame in itertools.islice(frames, self.max_pending_frames)
+            )
+            while pending_frames:
+                transformed_frame = pending_frames.popleft().result()
+                for frame in itertools.islice(frames, 1):
+                    pending_frames.append(pool.submit(self.function, frame))
+                yield transformed_frame
+
+
+class FrameStackStage:
+    """Transform applied to stacks of consecutive frames, for vectorized functions working on a whole
+    (N, H, W, 3) stack at once such as image_editor.insert_subtitle_on_frame_stack. Stacks are
+    transformed by a FrameStage, and their frames leave the stage one by one in input order
+    """
+
+    def __init__(
+        self, function, stack_size=_default_frame_stack_size, number_of_workers=1
+    ):
+        """
+        :param function: Function taking a BGR frame stack and returning the transformed stack, e.g. functools.partial(image_editor.insert_subtitle_on_frame_stack, text="Hello"). All frames must have the same shape
+        :param stack_size: Maximum number of frames per stack, defaults to _default_frame_stack_size
+        :param number_of_workers: Number of threads transforming stacks, defaults to 1
+        """
+        self.stack_size = stack_size
+        self.stack_stage = FrameStage(
+            function,
+            number_of_workers=number_of_workers,
+            max_pending_frames=number_of_workers,
+        )
+
+    def process(self, frames):
+        """Apply the stage to a stream of frames
+
+        :param frames: Iterable of frames
+        :return: Generator of transformed frames, in input order
+        """
+        for frame_stack in self.stack_stage.process(self._iter_stacks(frames)):
+            yield from frame_stack
+
+    def _iter_stacks(self, frames):
+        # Every stack is a new array, as frames of previous stacks may still be queued downstream
+        frames = iter(frames)
+        while True:
+            list_of_frames = list(itertools.islice(frames, self.stack_size))
+            if not list_of_frames:
+                return
+            yield numpy.stack(list_of_frames)
+
+
+class PngDirectoryWriter:
+    """Frame sink writing every frame as a PNG file, named by frame index as extracted frames are"""
+
+    def __init__(self, target_directory, frame_prefix=""):
+        """
+        :param target_directory: Path to store the frames
+        :param frame_prefix: Prefix for the frame names, defaults to ""
+        """
+        self.target_directory = target_directory
+        self.frame_prefix = frame_prefix
+        self.number_of_frames = 0
+
+    def write(self, frame):
+        image_editor.save_img(
+            img=frame,
+            target_file_name=f"{f'{self.frame_prefix}_' if self.frame_prefix else ''}{str(self.number_of_frames).zfill(8)}",
+            target_directory=self.target_directory,
+            overwrite=True,
+        )
+        self.number_of_frames += 1
+
+    def release(self):
+        image_editor.flush_img_writer()
+
+
+def iter_video_file_frames(path_to_video, target_fps=None):
+    """Frame source decoding a video file
+
+    :param path_to_video: Path to video
+    :param target_fps: Frame rate to resample the video to while decoding it with FFMPEG. If None, OpenCV decodes the video at its own frame rate. Defaults to None
+    :return: Generator of BGR frames
+    """
+    if target_fps is None:
+        vidcap = cv2.VideoCapture(str(path_to_video))
+    else:
+        vidcap = video_editor.FfmpegVideoCapture(path_to_video, target_fps=target_fps)
+    try:
+        while True:
+            frame_exists, frame = vidcap.read()
+            if not frame_exists:
+                return
+            yield frame
+    finally:
+        vidcap.release()
+
+
+def iter_frame_directory_frames(directory_path):
+    """Frame source reading a directory of PNG frames or a frame store
+
+    :param directory_path: Path to directory
+    :return: Generator of BGR frames
+    """
+    for frame in frame_store.open_frame_sequence(directory_path):
+        # Frames from a frame store are read-only views of the store
+        yield frame if frame.flags.writeable else frame.copy()
+
+
+def run_frame_pipeline(
+    frames,
+    list_of_stages,
+    sink,
+    total_number_of_frames=None,
+    max_queue_size=_default_frame_pipeline_queue_size,
+):
+    """Stream frames from a source through a list of transform stages into a sink. The source is read by
+    a background thread and every stage runs its own workers, so decoding, transforming and encoding
+    overlap while frames keep their order
+
+    :param frames: Iterable of BGR frames, e.g. iter_video_file_frames or iter_frame_directory_frames
+    :param list_of_stages: List of FrameStage or FrameStackStage, applied in order
+    :param sink: Object with write(frame) and release() methods, e.g. cv2.VideoWriter, video_editor.FfmpegVideoWriter or PngDirectoryWriter. It's released when the pipeline ends
+    :param total_number_of_frames: Expected number of frames, only used for the progress bar, defaults to None
+    :param max_queue_size: Maximum number of frames read ahead from the source, defaults to _default_frame_pipeline_queue_size
+    :return: Number of frames written to the sink
+    """
+    frames = _iter_in_background(frames, max_queue_size)
+    for stage in list_of_stages:
+        frames = stage.process(frames)
+
+    number_of_frames = 0
+    try:
+        for frame in tqdm.tqdm(frames, total=total_number_of_frames):
+            sink.write(frame)
+            number_of_frames += 1
+    finally:
+        sink.release()
+    return number_of_frames
+
+
+def _iter_in_background(frames, max_queue_size):
+    frame_queue = queue.Queue(maxsize=max_queue_size)
+    consumer_stopped = threading.Event()
+
+    def put_in_queue(item):
+        # Give up if the consumer stopped, instead of blocking on a full queue forever
+        while not consumer_stopped.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read_frames():
+        try:
+            for frame in frames:
+                if not put_in_queue((frame, None)):
+                    break
+            else:
+                put_in_queue((_end_of_stream, None))
+        except Exception as error:
+            put_in_queue((_end_of_stream, error))
+        finally:
+            close_frames = getattr(frames, "close", None)
+            if close_frames is not None:
+                close_frames()
+
+    reader_thread = threading.Thread(target=read_frames, daemon=True)
+    reader_thread.start()
+    try:
+        while True:
+            frame, error = frame_queue.get()
+            if frame is _end_of_stream:
+                if error is not None:
+                    raise error
+                return
+            yield frame
+    finally:
+        consumer_stopped.set()
+        reader_thread.join()
@@ -0,0 +1,255 @@
+import bisect
+import json
+from pathlib import Path
+
+import cv2
+import numpy
+
+import directory_index
+from config import _frame_store_chunk_max_bytes
+
+_frame_store_index_file_name = "frame_store.json"
+
+
+class FrameStoreWriter:
+    """Write a sequence of same-shape frames as raw chunk files, every chunk holding a fixed number of
+    frames back to back, so they can be memory-mapped by FrameStoreReader without decoding anything
+    """
+
+    def __init__(
+        self,
+        directory_path,
+        fps=None,
+        frame_prefix="",
+        first_frame_index=0,
+        chunk_max_bytes=_frame_store_chunk_max_bytes,
+        write_index=True,
+    ):
+        """
+        :param directory_path: Path to directory to store the frames
+        :param fps: Frame rate of the sequence, stored in the index, defaults to None
+        :param frame_prefix: Prefix used to name frames, as in extracted PNG frames, defaults to ""
+        :param first_frame_index: Index of the first appended frame, used to write segments of a sequence in parallel, defaults to 0
+        :param chunk_max_bytes: Maximum size of a chunk file, defaults to _frame_store_chunk_max_bytes
+        :param write_index: If False, the index is not written on close and the chunks have to be passed to write_frame_store_index, defaults to True
+        """
+        self.directory_path = Path(directory_path)
+        self.fps = fps
+        self.frame_prefix = frame_prefix
+        self.chunk_max_bytes = chunk_max_bytes
+        self.write_index = write_index
+        self.frame_shape = None
+        self.dtype = None
+        self.chunks = []
+        self._next_frame_index = first_frame_index
+        self._frames_per_chunk = None
+        self._chunk_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, frame):
+        """Append a frame to the store. All frames must have the shape and dtype of the first one
+
+        :param frame: OpenCV-compatible (BGR NumPy array) frame
+        """
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+            self.dtype = frame.dtype
+            self._frames_per_chunk = max(1, self.chunk_max_bytes // frame.nbytes)
+        elif frame.shape != self.frame_shape or frame.dtype != self.dtype:
+            raise ValueError(
+                f"Frame of shape {frame.shape} ({frame.dtype}) doesn't match the frame store "
+                f"shape {self.frame_shape} ({self.dtype})"
+            )
+
+        if (
+            self._chunk_file is None
+            or self.chunks[-1]["number_of_frames"] == self._frames_per_chunk
+        ):
+            self._start_chunk()
+        self._chunk_file.write(numpy.ascontiguousarray(frame).data)
+        self.chunks[-1]["number_of_frames"] += 1
+        self._next_frame_index += 1
+
+    def _start_chunk(self):
+        if self._chunk_file is not None:
+            self._chunk_file.close()
+        chunk_file_name = f"chunk_{str(self._next_frame_index).zfill(8)}.raw"
+        self._chunk_file = open(self.directory_path / chunk_file_name, "wb")
+        self.chunks.append(
+            {
+                "file_name": chunk_file_name,
+                "first_frame_index": self._next_frame_index,
+                "number_of_frames": 0,
+            }
+        )
+
+    def close(self):
+        """Close the last chunk file and write the index if write_index is set
+
+        :return: List of written chunks
+        """
+        if self._chunk_file is not None:
+            self._chunk_file.close()
+            self._chunk_file = None
+        if self.write_index and self.frame_shape is not None:
+            write_frame_store_index(
+                self.directory_path,
+                self.frame_shape,
+                self.dtype,
+                self.chunks,
+                fps=self.fps,
+                frame_prefix=self.frame_prefix,
+            )
+        return self.chunks
+
+
+def write_frame_store_index(
+    directory_path, frame_shape, dtype, list_of_chunks, fps=None, frame_prefix=""
+):
+    """Write the index of a frame store, gathering the chunks written by one or more FrameStoreWriter
+
+    :param directory_path: Path to frame store directory
+    :param frame_shape: Shape of every frame, e.g. (h, w, 3)
+    :param dtype: NumPy dtype of the frames
+    :param list_of_chunks: List of chunks returned by FrameStoreWriter.close
+    :param fps: Frame rate of the sequence, defaults to None
+    :param frame_prefix: Prefix used to name frames, defaults to ""
+    """
+    directory_index.write_json_file_atomically(
+        Path(directory_path) / _frame_store_index_file_name,
+        {
+            "frame_shape": list(frame_shape),
+            "dtype": numpy.dtype(dtype).str,
+            "fps": fps,
+            "frame_prefix": frame_prefix,
+            "chunks": sorted(
+                list_of_chunks, key=lambda chunk: chunk["first_frame_index"]
+            ),
+        },
+    )
+
+
+class FrameStoreReader:
+    """Random access to the frames of a frame store. Chunks are memory-mapped on first access, so reading
+    any frame costs a page fault instead of opening and decoding a file. Frames are read-only views
+    """
+
+    def __init__(self, directory_path):
+        """
+        :param directory_path: Path to frame store directory
+        """
+        self.directory_path = Path(directory_path)
+        with open(self.directory_path / _frame_store_index_file_name) as index_file:
+            index = json.load(index_file)
+        self.frame_shape = tuple(index["frame_shape"])
+        self.dtype = numpy.dtype(index["dtype"])
+        self.fps = index["fps"]
+        self.frame_prefix = index["frame_prefix"]
+        self._chunks = index["chunks"]
+        self._chunk_first_frame_indices = [
+            chunk["first_frame_index"] for chunk in self._chunks
+        ]
+        self._chunk_arrays = [None] * len(self._chunks)
+
+        self.number_of_frames = 0
+        for chunk in self._chunks:
+            if chunk["first_frame_index"] != self.number_of_frames:
+                raise ValueError(
+                    f"Frame store {self.directory_path} is missing frames "
+                    f"{self.number_of_frames} to {chunk['first_frame_index'] - 1}"
+                )
+            self.number_of_frames += chunk["number_of_frames"]
+
+    def __len__(self):
+        return self.number_of_frames
+
+    def __getitem__(self, frame_index):
+        if frame_index < 0:
+            frame_index += self.number_of_frames
+        if not 0 <= frame_index < self.number_of_frames:
+            raise IndexError(
+                f"Frame {frame_index} out of range, the store has {self.number_of_frames} frames"
+            )
+        chunk_number = (
+            bisect.bisect_right(self._chunk_first_frame_indices, frame_index) - 1
+        )
+        return self._get_chunk_array(chunk_number)[
+            frame_index - self._chunk_first_frame_indices[chunk_number]
+        ]
+
+    def __iter__(self):
+        for chunk_number in range(len(self._chunks)):
+            yield from self._get_chunk_array(chunk_number)
+
+    def _get_chunk_array(self, chunk_number):
+        if self._chunk_arrays[chunk_number] is None:
+            chunk = self._chunks[chunk_number]
+            self._chunk_arrays[chunk_number] = numpy.memmap(
+                self.directory_path / chunk["file_name"],
+                dtype=self.dtype,
+                mode="r",
+                shape=(chunk["number_of_frames"], *self.frame_shape),
+            )
+        return self._chunk_arrays[chunk_number]
+
+    def get_frame_file_name(self, frame_index):
+        """Name the frame would have if the video had been extracted to PNG files
+
+        :param frame_index: Frame index
+        :return: File name
+        """
+        return f"{f'{self.frame_prefix}_' if self.frame_prefix else ''}{str(frame_index).zfill(8)}.png"
+
+
+class FrameDirectory:
+    """Same interface as FrameStoreReader for a directory of PNG frames, decoding every frame on access"""
+
+    def __init__(self, directory_path):
+        """
+        :param directory_path: Path to directory with frames
+        """
+        self.directory_path = Path(directory_path)
+        self.file_paths = directory_index.list_all_pngs_in_dir(directory_path)
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    def __getitem__(self, frame_index):
+        return cv2.imread(str(self.file_paths[frame_index]))
+
+    def __iter__(self):
+        for file_path in self.file_paths:
+            yield cv2.imread(str(file_path))
+
+    def get_frame_file_name(self, frame_index):
+        """Name of the frame file
+
+        :param frame_index: Frame index
+        :return: File name
+        """
+        return self.file_paths[frame_index].name
+
+
+def is_frame_store(directory_path):
+    """Check if a directory holds a frame store
+
+    :param directory_path: Path to directory
+    :return: True if the directory has a frame store index
+    """
+    return (Path(directory_path) / _frame_store_index_file_name).is_file()
+
+
+def open_frame_sequence(directory_path):
+    """Open the frames in a directory, either from a frame store or from PNG files
+
+    :param directory_path: Path to directory with a frame store or PNG frames
+    :return: FrameStoreReader or FrameDirectory, both give BGR NumPy arrays by index or iteration
+    """
+    if is_frame_store(directory_path):
+        return FrameStoreReader(directory_path)
+    return FrameDirectory(directory_path)
@@ -1,10 +1,33 @@
+import atexit
+import collections
+import contextlib
+import functools
+import os
+import shutil
+import struct
+import threading
+from concurrent import futures
+
 import cv2
 import numpy
 import qrcode
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageOps
+
+import directory_index
+from config import (
+    _arial_font_path,
+    _default_font_path,
+    _default_img_writer_max_pending,
+    _default_subtitle_height_percentage,
+    _font_fit_cache_size,
+    _font_pool_size,
+    _max_font_size,
+    _qr_code_cache_size,
+    _text_sprite_cache_max_bytes,
+)
 
-import file_manager.file_manager as file_manager
-from config import _default_subtitle_height_percentage
+# Scratch canvas only used to measure text, never drawn on
+_text_measuring_canvas = ImageDraw.Draw(Image.new("1", (1, 1)))
 
 
 def open_image(path_to_img):
@@ -47,34 +70,342 @@ def convert_opencv_format_to_pil(img):
 
 
 def strip_exif(img):
-    """Strip EXIF metadata from image
+    """Strip EXIF metadata from image. The pixels are copied as a single raw buffer,
+    if you only need to strip metadata from a file, strip_metadata_from_file avoids decoding it at all
 
     :param img: PIL instance of image
     :return: PIL instance of image with stripped EXIF
     """
-    data = img.getdata()
-    img = Image.new(img.mode, img.size)
-    img.putdata(data)
-    return img
+    stripped_img = Image.frombytes(img.mode, img.size, img.tobytes())
+    if img.mode in ("P", "PA"):
+        stripped_img.putpalette(img.getpalette())
+    return stripped_img
+
+
+def strip_metadata_from_file(
+    path_to_img, target_file_name, target_directory, overwrite=False
+):
+    """Strip EXIF, XMP and ICC metadata from an image file. JPEG, PNG and WebP files are rewritten
+    at the container level, without decoding pixel data. Any other format is decoded and re-encoded
+    through strip_exif
+
+    :param path_to_img: Path to img
+    :param target_file_name: Target name for stripped image, without suffix
+    :param target_directory: Path to store stripped image
+    :param overwrite: Flag to select file overwriting, defaults to False
+    :return: Path to stripped image
+    """
+    target_file_path = target_directory / f"{target_file_name}{path_to_img.suffix}"
+    if overwrite:
+        _strip_metadata_into_file(path_to_img, target_file_path)
+        return target_file_path
+
+    target_file_path = directory_index.reserve_unique_file_path(target_file_path)
+    try:
+        _strip_metadata_into_file(path_to_img, target_file_path)
+    except BaseException:
+        directory_index.release_reserved_file_path(target_file_path)
+        raise
+    return target_file_path
+
+
+def _strip_metadata_into_file(path_to_img, target_file_path):
+    with open(path_to_img, "rb") as source_file:
+        signature = source_file.read(12)
+        source_file.seek(0)
+        if signature.startswith(b"\xff\xd8"):
+            strip_metadata = _strip_jpeg_metadata
+        elif signature.startswith(_png_signature):
+            strip_metadata = _strip_png_metadata
+        elif signature[:4] == b"RIFF" and signature[8:12] == b"WEBP":
+            strip_metadata = _strip_webp_metadata
+        else:
+            strip_metadata = None
+
+        if strip_metadata is not None:
+            # Write next to the target first, the source might be the target itself
+            tmp_file_path = target_file_path.with_name(f".{target_file_path.name}.tmp")
+            try:
+                with open(tmp_file_path, "wb") as target_file:
+                    strip_metadata(source_file, target_file)
+                os.replace(tmp_file_path, target_file_path)
+            except BaseException:
+                tmp_file_path.unlink(missing_ok=True)
+                raise
+            return
+
+    # Unknown container, decoding is unavoidable
+    img = open_image(path_to_img)
+    strip_exif(img).save(target_file_path, format=img.format)
+
+
+# APP1 holds EXIF and XMP, APP2 holds ICC profiles and APP13 holds IPTC
+_jpeg_metadata_markers = {0xE1, 0xE2, 0xED}
+_jpeg_start_of_scan_marker = 0xDA
+
+_png_signature = b"\x89PNG\r\n\x1a\n"
+_png_metadata_chunks = {b"eXIf", b"iCCP", b"iTXt", b"tEXt", b"zTXt", b"tIME"}
+
+_webp_metadata_chunks = {b"EXIF", b"XMP ", b"ICCP"}
+# VP8X feature flags announcing ICC, EXIF and XMP chunks
+_webp_vp8x_metadata_flags = 0x20 | 0x08 | 0x04
+
+
+def _strip_jpeg_metadata(source_file, target_file):
+    target_file.write(source_file.read(2))
+    while True:
+        marker_prefix = source_file.read(1)
+        if not marker_prefix:
+            return
+        if marker_prefix != b"\xff":
+            raise ValueError(f"Corrupt JPEG {source_file.name}, expected a marker")
+        marker = _read_jpeg_bytes(source_file, 1)[0]
+        # Markers can be padded with any number of 0xFF fill bytes
+        while marker == 0xFF:
+            marker = _read_jpeg_bytes(source_file, 1)[0]
+        # Standalone markers carry no length field
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            target_file.write(bytes((0xFF, marker)))
+            continue
+
+        segment_length_bytes = _read_jpeg_bytes(source_file, 2)
+        (segment_length,) = struct.unpack(">H", segment_length_bytes)
+        # The length field counts itself
+        if segment_length < 2:
+            raise ValueError(
+                f"Corrupt JPEG {source_file.name}, invalid segment length {segment_length}"
+            )
+        segment_data = _read_jpeg_bytes(source_file, segment_length - 2)
+        if marker not in _jpeg_metadata_markers:
+            target_file.write(bytes((0xFF, marker)))
+            target_file.write(segment_length_bytes)
+            target_file.write(segment_data)
+
+        if marker == _jpeg_start_of_scan_marker:
+            # Entropy-coded image data follows, copy it untouched
+            shutil.copyfileobj(source_file, target_file)
+            return
+
+
+def _read_jpeg_bytes(source_file, number_of_bytes):
+    data = source_file.read(number_of_bytes)
+    if len(data) < number_of_bytes:
+        raise ValueError(f"Corrupt JPEG {source_file.name}, truncated segment")
+    return data
+
+
+def _strip_png_metadata(source_file, target_file):
+    target_file.write(source_file.read(len(_png_signature)))
+    while True:
+        chunk_header = source_file.read(8)
+        if len(chunk_header) < 8:
+            return
+        chunk_length, chunk_type = struct.unpack(">I4s", chunk_header)
+        # Chunk data is followed by a 4 bytes CRC
+        if chunk_type in _png_metadata_chunks:
+            source_file.seek(chunk_length + 4, os.SEEK_CUR)
+            continue
+        target_file.write(chunk_header)
+        _copy_file_bytes(source_file, target_file, chunk_length + 4)
+
+
+def _strip_webp_metadata(source_file, target_file):
+    source_file.read(12)
+    # RIFF size is patched once the kept chunks are known
+    target_file.write(b"RIFF\x00\x00\x00\x00WEBP")
+    riff_size = 4
+    while True:
+        chunk_header = source_file.read(8)
+        if len(chunk_header) < 8:
+            break
+        chunk_type, chunk_length = struct.unpack("<4sI", chunk_header)
+        # Chunks are padded to an even size
+        padded_chunk_length = chunk_length + (chunk_length & 1)
+        if chunk_type in _webp_metadata_chunks:
+            source_file.seek(padded_chunk_length, os.SEEK_CUR)
+            continue
+        target_file.write(chunk_header)
+        if chunk_type == b"VP8X":
+            vp8x_data = bytearray(source_file.read(padded_chunk_length))
+            vp8x_data[0] &= ~_webp_vp8x_metadata_flags & 0xFF
+            target_file.write(vp8x_data)
+        else:
+            _copy_file_bytes(source_file, target_file, padded_chunk_length)
+        riff_size += 8 + padded_chunk_length
+
+    target_file.seek(4)
+    target_file.write(struct.pack("<I", riff_size))
+
+
+def _copy_file_bytes(source_file, target_file, number_of_bytes, buffer_size=1 << 20):
+    while number_of_bytes > 0:
+        buffer = source_file.read(min(buffer_size, number_of_bytes))
+        if not buffer:
+            raise ValueError("Unexpected end of file")
+        target_file.write(buffer)
+        number_of_bytes -= len(buffer)
 
 
 def save_img(
-    img, target_file_name, target_directory, dpi=None, img_format="png", overwrite=False
+    img,
+    target_file_name,
+    target_directory,
+    dpi=None,
+    img_format="png",
+    overwrite=False,
+    compression_level=None,
 ):
-    """Save PIL instance of an image
+    """Save an image. If the asynchronous image writer is active (see async_img_writing), the image is
+    only enqueued and encoded in a background thread, so it must not be modified afterwards
 
-    :param img: PIL instance of an image
+    :param img: PIL instance of an image or OpenCV-compatible (BGR NumPy array) image
     :param target_file_name: Target name for input image, without suffix
     :param target_directory: Path to store image
-    :param dpi: Target dots per inch, defaults to None
+    :param dpi: Target dots per inch, only used for PIL images, defaults to None
     :param img_format: Target file format, defaults to "png"
     :param overwrite: Flag to select file overwriting, defaults to False
+    :param compression_level: Format-specific compression level, PNG levels go from 0 (none) to 9 (max), JPEG and WebP levels are qualities from 1 to 100. If None, the defaults of the library writing the image are used (PIL or OpenCV). Defaults to None
+    :return: Path to saved image
     """
     target_file_path = target_directory / f"{target_file_name}.{img_format}"
-    if target_file_path.exists() and not overwrite:
-        target_file_path = file_manager.find_new_unique_file_path(target_file_path)
+    if not overwrite:
+        target_file_path = directory_index.reserve_unique_file_path(target_file_path)
+
+    write_args = (img, target_file_path, dpi, img_format, compression_level, overwrite)
+    if _async_img_writer is not None:
+        _async_img_writer.submit(_write_img, *write_args)
+    else:
+        _write_img(*write_args)
+    return target_file_path
+
+
+def _write_img(img, target_file_path, dpi, img_format, compression_level, overwrite):
+    try:
+        _encode_img_to_file(img, target_file_path, dpi, img_format, compression_level)
+    except BaseException:
+        # Don't leave the empty reserved file behind
+        if not overwrite:
+            directory_index.release_reserved_file_path(target_file_path)
+        raise
+
+
+def _encode_img_to_file(img, target_file_path, dpi, img_format, compression_level):
+    img_format = img_format.lower()
+    if isinstance(img, numpy.ndarray):
+        params = []
+        if compression_level is not None and img_format in _opencv_compression_flags:
+            params = [_opencv_compression_flags[img_format], compression_level]
+        if not cv2.imwrite(str(target_file_path), img, params):
+            raise IOError(f"Could not write {target_file_path}")
+        return
+
+    save_params = {}
+    if compression_level is not None and img_format in _pil_compression_params:
+        save_params[_pil_compression_params[img_format]] = compression_level
+    img.save(target_file_path, dpi=dpi, **save_params)
+
+
+_pil_compression_params = {
+    "png": "compress_level",
+    "jpg": "quality",
+    "jpeg": "quality",
+    "webp": "quality",
+}
+_opencv_compression_flags = {
+    "png": cv2.IMWRITE_PNG_COMPRESSION,
+    "jpg": cv2.IMWRITE_JPEG_QUALITY,
+    "jpeg": cv2.IMWRITE_JPEG_QUALITY,
+    "webp": cv2.IMWRITE_WEBP_QUALITY,
+}
+
+
+class AsyncImageWriter:
+    """Thread pool draining a bounded queue of image writes. PIL and OpenCV release the GIL while
+    encoding, so decoding and drawing the next images overlaps with encoding the previous ones
+    """
+
+    def __init__(self, max_workers=None, max_pending=_default_img_writer_max_pending):
+        """Start writer threads
+
+        :param max_workers: Number of writer threads, if None, ThreadPoolExecutor's default. Defaults to None
+        :param max_pending: Maximum number of queued writes, submitting more blocks until one finishes. Defaults to _default_img_writer_max_pending
+        """
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="img_writer"
+        )
+        self._free_slots = threading.BoundedSemaphore(max_pending)
+        self._pending_writes = set()
+        self._lock = threading.Lock()
+
+    def submit(self, write_function, *args):
+        """Enqueue a write, blocking while the queue is full
+
+        :param write_function: Function performing the write
+        :param args: Arguments for write_function
+        """
+        self._free_slots.acquire()
+        try:
+            future = self._executor.submit(write_function, *args)
+        except BaseException:
+            self._free_slots.release()
+            raise
+        with self._lock:
+            self._pending_writes.add(future)
+        future.add_done_callback(self._release_slot)
+
+    def _release_slot(self, future):
+        self._free_slots.release()
+
+    def flush(self):
+        """Block until all enqueued writes are done. Raises the first error found in a failed write"""
+        with self._lock:
+            pending_writes, self._pending_writes = self._pending_writes, set()
+        errors = [future.exception() for future in futures.as_completed(pending_writes)]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """Flush enqueued writes and stop writer threads"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+_async_img_writer = None
+
+
+@contextlib.contextmanager
+def async_img_writing(max_workers=None, max_pending=_default_img_writer_max_pending):
+    """Context in which save_img enqueues writes to an AsyncImageWriter instead of blocking on encoding.
+    All writes are flushed when leaving the context
+
+    :param max_workers: Number of writer threads, if None, ThreadPoolExecutor's default. Defaults to None
+    :param max_pending: Maximum number of queued writes, defaults to _default_img_writer_max_pending
+    """
+    global _async_img_writer
+    previous_img_writer = _async_img_writer
+    _async_img_writer = AsyncImageWriter(
+        max_workers=max_workers, max_pending=max_pending
+    )
+    try:
+        yield _async_img_writer
+    finally:
+        img_writer, _async_img_writer = _async_img_writer, previous_img_writer
+        img_writer.close()
+
 
-    img.save(target_file_path, dpi=dpi)
+def flush_img_writer():
+    """Block until all images enqueued by save_img are written, no-op if writes are synchronous"""
+    if _async_img_writer is not None:
+        _async_img_writer.flush()
+
+
+@atexit.register
+def _close_img_writer_at_exit():
+    if _async_img_writer is not None:
+        _async_img_writer.close()
 
 
 def invert(img):
@@ -96,9 +427,9 @@ def insert_rectangle(
     outline_color=None,
     outline_width=None,
 ):
-    """Insert an opaque rectangle to PIL image
+    """Insert an opaque rectangle to an image, drawing in place
 
-    :param img: PIL instance of image
+    :param img: PIL instance of image or OpenCV-compatible frame, a (H, W, 3) BGR NumPy array
     :param position: Tuple x,y for rectangle position
     :param rectangle_height: Rectangle height in pixels
     :param rectangle_width: Rectangle width in pixels
@@ -106,14 +437,33 @@ def insert_rectangle(
     :param anchor_point: Anchor point for rectangle positioning, defaults to "top_left"
     :param outline_color: defaults to None
     :param outline_width: defaults to None
+    :return: Same image instance, with the rectangle drawn
     """
     # X is the horizontal axis, top left corner of the picture is 0
     # Y is the vertical axis, top left corner of the picture is 0
-    draw = ImageDraw.Draw(img)
     if anchor_point == "bottom_left":
         offset = [0, -rectangle_height]
         position = [x + y for x, y in zip(offset, position)]
 
+    if isinstance(img, numpy.ndarray):
+        x0, y0 = int(position[0]), int(position[1])
+        # PIL rectangles include their end coordinates
+        x1 = int(position[0] + rectangle_width) + 1
+        y1 = int(position[1] + rectangle_height) + 1
+        if rectangle_fill_color is not None:
+            _fill_frame_region(
+                img, x0, y0, x1, y1, convert_color_to_bgr(rectangle_fill_color)
+            )
+        if outline_color is not None:
+            bgr = convert_color_to_bgr(outline_color)
+            width = outline_width or 1
+            _fill_frame_region(img, x0, y0, x1, y0 + width, bgr)
+            _fill_frame_region(img, x0, y1 - width, x1, y1, bgr)
+            _fill_frame_region(img, x0, y0, x0 + width, y1, bgr)
+            _fill_frame_region(img, x1 - width, y0, x1, y1, bgr)
+        return img
+
+    draw = ImageDraw.Draw(img)
     draw.rectangle(
         xy=(
             position[0],
@@ -125,6 +475,7 @@ def insert_rectangle(
         outline=outline_color,
         width=outline_width,
     )
+    return img
 
 
 def insert_text(
@@ -135,50 +486,29 @@ def insert_text(
     max_height_pix,
     color="white",
     anchor_point="top_left",
+    font_path=_arial_font_path,
 ):
-    """Insert text on PIL image
+    """Insert text on an image, drawing in place
 
-    :param img: PIL instance of image
+    :param img: PIL instance of image or OpenCV-compatible frame, a (H, W, 3) BGR NumPy array
     :param text: String to insert
     :param position: Tuple X, Y for text position_
     :param max_width_pix: Maximum text width allowed in pixels
     :param max_height_pix: Maximum text height allowed in pixels
     :param color: defaults to "white"
     :param anchor_point: Anchor point for text positioning, defaults to "top_left"
+    :param font_path: Path to .ttf font file, defaults to _arial_font_path
+    :return: Same image instance, with the text drawn
     """
-    draw = ImageDraw.Draw(img)
-
-    # Initialize font size
-    font_size = 100
-    font = ImageFont.truetype("/Library/fonts/Arial.ttf", font_size)
-
-    w, h = draw.textsize(text, font)
-    # This value would override the font size
-    while h >= max_height_pix:
-        font_size -= 1
-        font = ImageFont.truetype("/Library/fonts/Arial.ttf", font_size)
-        w, h = draw.textsize(text, font)
-
-    while h <= max_height_pix:
-        font_size += 1
-        font = ImageFont.truetype("/Library/fonts/Arial.ttf", font_size)
-        w, h = draw.textsize(text, font)
-
-    if w > max_width_pix:
-        text_fits_in_rectangle = False
+    font_size = find_best_font_size(
+        text, max_width_pix, max_height_pix, font_path=font_path
+    )
+    if isinstance(img, numpy.ndarray):
+        sprite = text_sprite_cache.get_sprite_arrays(text, font_size, color, font_path)
+        h, w = sprite[0].shape[:2]
     else:
-        text_fits_in_rectangle = True
-
-    if not text_fits_in_rectangle:
-        while w >= max_width_pix:
-            font_size -= 1
-            font = ImageFont.truetype("/Library/fonts/Arial.ttf", font_size)
-            w, h = draw.textsize(text, font)
-
-        while w <= max_width_pix:
-            font_size += 1
-            font = ImageFont.truetype("/Library/fonts/Arial.ttf", font_size)
-            w, h = draw.textsize(text, font)
+        sprite = text_sprite_cache.get_sprite(text, font_size, color, font_path)
+        w, h = sprite.size
 
     offset = (0, 0)
     if anchor_point == "center":
@@ -189,7 +519,12 @@ def insert_text(
         offset = [0, -h]
         position = [x + y for x, y in zip(offset, position)]
 
-    draw.text(xy=position, text=text, fill=color, font=font)
+    position = tuple(int(coord) for coord in position)
+    if isinstance(img, numpy.ndarray):
+        _alpha_blend_sprite_arrays(img, sprite, position)
+    else:
+        img.paste(sprite, position, sprite)
+    return img
 
 
 def insert_text_box(
@@ -202,9 +537,9 @@ def insert_text_box(
     text_color="white",
     anchor_point="top_left",
 ):
-    """Combination of rectangle + text insertion to a PIL image in one method
+    """Combination of rectangle + text insertion to an image in one method
 
-    :param img: PIL instance of image
+    :param img: PIL instance of image or OpenCV-compatible frame, a (H, W, 3) BGR NumPy array
     :param text: String to insert
     :param position: Tuple X,Y for text box positioning
     :param box_width: Box width in pixels
@@ -212,6 +547,7 @@ def insert_text_box(
     :param box_color: defaults to "black"
     :param text_color: defaults to "white"
     :param anchor_point: Anchor point for text box positioning, defaults to "top_left"
+    :return: Same image instance, with the text box drawn
     """
     insert_rectangle(
         img=img,
@@ -221,7 +557,7 @@ def insert_text_box(
         rectangle_width=box_width,
         anchor_point=anchor_point,
     )
-    img_w, img_h = img.size
+    img_w, img_h = get_img_size(img)
     quiet_zone_w = img_w * 0.01
     quiet_zone_h = img_h * 0.01
     text_position = [position[0] + quiet_zone_w, position[1] + quiet_zone_h]
@@ -234,6 +570,7 @@ def insert_text_box(
         position=text_position,
         anchor_point=anchor_point,
     )
+    return img
 
 
 def insert_subtitle(
@@ -242,43 +579,163 @@ def insert_subtitle(
     color="white",
     subtitle_height_percentage=_default_subtitle_height_percentage,
 ):
-    """Insert subtitle to PIL image, by default a black background covering all image width will be introduced
+    """Insert subtitle to an image, by default a black background covering all image width will be introduced
 
-    :param img: PIL instance of image
+    :param img: PIL instance of image or OpenCV-compatible frame, a (H, W, 3) BGR NumPy array
     :param text: String to insert
     :param color: defaults to "white"
     :param subtitle_height_percentage: Height percentage of the image occupied as a subtitle overlay, defaults to _default_subtitle_height_percentage
+    :return: Same image instance, with the subtitle drawn
     """
-    position = [0, img.size[1]]
-    anchor_point = "bottom_left"
-    rectangle_height = img.size[1] * subtitle_height_percentage
-    rectangle_width = img.size[0]
+    img_w, img_h = get_img_size(img)
+    rectangle_height, text_position = _get_subtitle_layout(
+        img_w, img_h, subtitle_height_percentage
+    )
 
     insert_rectangle(
         img=img,
         rectangle_fill_color="black",
-        position=position,
+        position=[0, img_h],
         rectangle_height=rectangle_height,
-        rectangle_width=rectangle_width,
-        anchor_point=anchor_point,
+        rectangle_width=img_w,
+        anchor_point="bottom_left",
     )
 
-    img_w, img_h = img.size
-    # quiet_zone_w = img_w * 0.01
-    quiet_zone_h = img_h * 0.005
-
-    text_position = [img_w / 2, img_h - rectangle_height / 2 - quiet_zone_h]
-    anchor_point = "center"
     insert_text(
         img=img,
         text=text,
         color=color,
-        max_width_pix=rectangle_width * 0.8,
+        max_width_pix=img_w * 0.8,
         max_height_pix=rectangle_height * 0.8,
         position=text_position,
+        anchor_point="center",
+    )
+    return img
+
+
+def _get_subtitle_layout(img_w, img_h, subtitle_height_percentage):
+    rectangle_height = img_h * subtitle_height_percentage
+    # quiet_zone_w = img_w * 0.01
+    quiet_zone_h = img_h * 0.005
+    text_position = [img_w / 2, img_h - rectangle_height / 2 - quiet_zone_h]
+    return rectangle_height, text_position
+
+
+def insert_rectangle_on_frame_stack(
+    frames,
+    position,
+    rectangle_height,
+    rectangle_width,
+    rectangle_fill_color="black",
+    anchor_point="top_left",
+    opacity=1.0,
+):
+    """Insert the same rectangle on every frame of a stack with a single vectorized operation
+
+    :param frames: OpenCV-compatible (BGR) frame stack as a NumPy array with shape (N, H, W, 3)
+    :param position: Tuple x,y for rectangle position
+    :param rectangle_height: Rectangle height in pixels
+    :param rectangle_width: Rectangle width in pixels
+    :param rectangle_fill_color: defaults to "black"
+    :param anchor_point: Anchor point for rectangle positioning, defaults to "top_left"
+    :param opacity: Rectangle opacity between 0 and 1, values below 1 blend the rectangle with the frames, defaults to 1.0
+    :return: Same frame stack, with the rectangle drawn on every frame
+    """
+    if anchor_point == "bottom_left":
+        offset = [0, -rectangle_height]
+        position = [x + y for x, y in zip(offset, position)]
+
+    _fill_frame_region(
+        frames,
+        int(position[0]),
+        int(position[1]),
+        int(position[0] + rectangle_width) + 1,
+        int(position[1] + rectangle_height) + 1,
+        convert_color_to_bgr(rectangle_fill_color),
+        opacity=opacity,
+    )
+    return frames
+
+
+def insert_text_on_frame_stack(
+    frames,
+    text,
+    position,
+    max_width_pix,
+    max_height_pix,
+    color="white",
+    anchor_point="top_left",
+    font_path=_arial_font_path,
+):
+    """Insert the same text on every frame of a stack. The text is rasterized once (or fetched from
+    text_sprite_cache) and blended on all frames with a single vectorized operation
+
+    :param frames: OpenCV-compatible (BGR) frame stack as a NumPy array with shape (N, H, W, 3)
+    :param text: String to insert
+    :param position: Tuple X, Y for text position
+    :param max_width_pix: Maximum text width allowed in pixels
+    :param max_height_pix: Maximum text height allowed in pixels
+    :param color: defaults to "white"
+    :param anchor_point: Anchor point for text positioning, defaults to "top_left"
+    :param font_path: Path to .ttf font file, defaults to _arial_font_path
+    :return: Same frame stack, with the text drawn on every frame
+    """
+    # insert_text only touches arrays through the Ellipsis-indexed region helpers
+    return insert_text(
+        img=frames,
+        text=text,
+        position=position,
+        max_width_pix=max_width_pix,
+        max_height_pix=max_height_pix,
+        color=color,
         anchor_point=anchor_point,
+        font_path=font_path,
+    )
+
+
+def insert_subtitle_on_frame_stack(
+    frames,
+    text,
+    color="white",
+    subtitle_height_percentage=_default_subtitle_height_percentage,
+    opacity=1.0,
+):
+    """Insert the same subtitle on every frame of a stack, with one vectorized operation for the
+    background bar and one for the text
+
+    :param frames: OpenCV-compatible (BGR) frame stack as a NumPy array with shape (N, H, W, 3)
+    :param text: String to insert
+    :param color: defaults to "white"
+    :param subtitle_height_percentage: Height percentage of the frames occupied as a subtitle overlay, defaults to _default_subtitle_height_percentage
+    :param opacity: Opacity of the black background bar between 0 and 1, defaults to 1.0
+    :return: Same frame stack, with the subtitle drawn on every frame
+    """
+    img_w, img_h = get_img_size(frames)
+    rectangle_height, text_position = _get_subtitle_layout(
+        img_w, img_h, subtitle_height_percentage
     )
 
+    insert_rectangle_on_frame_stack(
+        frames=frames,
+        rectangle_fill_color="black",
+        position=[0, img_h],
+        rectangle_height=rectangle_height,
+        rectangle_width=img_w,
+        anchor_point="bottom_left",
+        opacity=opacity,
+    )
+
+    insert_text_on_frame_stack(
+        frames=frames,
+        text=text,
+        color=color,
+        max_width_pix=img_w * 0.8,
+        max_height_pix=rectangle_height * 0.8,
+        position=text_position,
+        anchor_point="center",
+    )
+    return frames
+
 
 def stitch_images_side_by_side(list_of_imgs, list_of_subtitles=None):
     """Stitch images side by side based on the first image's height
@@ -287,28 +744,17 @@ def stitch_images_side_by_side(list_of_imgs, list_of_subtitles=None):
     :param list_of_subtitles: List of subtitles to be inserted on every stitched image, if None, no subtitle will be introduced. Defaults to None
     :return: PIL instance of image composition
     """
-    first_img = list_of_imgs[0]
-    first_img_size = first_img.size
-    total_size = [first_img_size[0], first_img_size[1]]
-    for img in list_of_imgs[1:]:
-        img_size = img.size
-        if img_size[1] != total_size[1]:
-            total_size[0] += int((img_size[0] / img_size[1]) * total_size[1])
-        else:
-            total_size[0] += img_size[0]
-
-    comp_img = create_blank_image(tuple(total_size))
+    total_size, list_of_scaled_sizes = _get_side_by_side_layout(
+        [img.size for img in list_of_imgs]
+    )
+    comp_img = create_blank_image(total_size)
 
     x_size_tracker = 0
-    for i, next_img in enumerate(list_of_imgs):
-        next_img_size = next_img.size
-        if next_img_size[1] != total_size[1]:
-            next_img = next_img.resize(
-                size=(
-                    int(next_img_size[0] / next_img_size[1] * total_size[1]),
-                    int(total_size[1]),
-                )
-            )
+    for i, (next_img, scaled_size) in enumerate(
+        zip(list_of_imgs, list_of_scaled_sizes)
+    ):
+        if next_img.size != scaled_size:
+            next_img = next_img.resize(size=scaled_size)
         if list_of_subtitles:
             insert_subtitle(next_img, list_of_subtitles[i])
 
@@ -318,71 +764,369 @@ def stitch_images_side_by_side(list_of_imgs, list_of_subtitles=None):
     return comp_img
 
 
+def stitch_image_files_side_by_side(list_of_img_paths, list_of_subtitles=None):
+    """Stitch image files side by side based on the first image's height. The layout is computed from
+    the image headers only, then every image is decoded, resized and pasted one at a time, so peak
+    memory is roughly one input image plus the composition
+
+    :param list_of_img_paths: List of paths to images
+    :param list_of_subtitles: List of subtitles to be inserted on every stitched image, if None, no subtitle will be introduced. Defaults to None
+    :return: PIL instance of image composition
+    """
+    # PIL reads the header on open and defers decoding until the pixels are accessed
+    list_of_sizes = []
+    for img_path in list_of_img_paths:
+        with open_image(img_path) as img:
+            list_of_sizes.append(img.size)
+
+    total_size, list_of_scaled_sizes = _get_side_by_side_layout(list_of_sizes)
+    comp_img = create_blank_image(total_size)
+
+    x_size_tracker = 0
+    for i, (img_path, scaled_size) in enumerate(
+        zip(list_of_img_paths, list_of_scaled_sizes)
+    ):
+        with open_image(img_path) as next_img:
+            if next_img.size != scaled_size:
+                # JPEG images can be downscaled by the decoder itself
+                next_img.draft("RGB", scaled_size)
+                next_img = next_img.resize(size=scaled_size)
+            if list_of_subtitles:
+                insert_subtitle(next_img, list_of_subtitles[i])
+
+            comp_img.paste(next_img, (x_size_tracker, 0))
+            x_size_tracker += scaled_size[0]
+
+    return comp_img
+
+
+def _get_side_by_side_layout(list_of_sizes):
+    # All images are scaled to match the first image's height
+    total_h = list_of_sizes[0][1]
+    list_of_scaled_sizes = [
+        (w, h) if h == total_h else (int(w / h * total_h), total_h)
+        for w, h in list_of_sizes
+    ]
+    total_w = sum(w for w, _ in list_of_scaled_sizes)
+    return (total_w, total_h), list_of_scaled_sizes
+
+
 def paste_img(
     main_img, img_to_paste, position, anchor_point="center", resizing_factor=1
 ):
-    """Paste img on PIL instance of an image
+    """Paste img on an image, drawing in place
 
-    :param main_img: PIL instance of base image
-    :param img_to_paste: PIL instance of image to be pasted
+    :param main_img: PIL instance of base image or OpenCV-compatible frame, a (H, W, 3) BGR NumPy array
+    :param img_to_paste: PIL instance or OpenCV-compatible (H, W, 3) BGR instance of image to be pasted
     :param position: Tuple X,Y for pasted image positioning
     :param anchor_point: Anchor point for pasted image positioning, defaults to "center"
-    :param resizing_factor: _description_, defaults to 1
+    :param resizing_factor: Scale factor for the pasted image, defaults to 1
+    :return: Same base image instance, with the image pasted
     """
-    img_w, img_h = img_to_paste.size
-    img_to_paste = img_to_paste.resize(
-        (int(img_h * resizing_factor), int(img_h * resizing_factor))
-    )
-    img_w, img_h = img_to_paste.size
+    img_w, img_h = get_img_size(img_to_paste)
+    target_size = (int(img_w * resizing_factor), int(img_h * resizing_factor))
+    if isinstance(img_to_paste, numpy.ndarray):
+        if target_size != (img_w, img_h):
+            img_to_paste = cv2.resize(img_to_paste, target_size)
+    elif target_size != (img_w, img_h):
+        img_to_paste = img_to_paste.resize(target_size)
+    img_w, img_h = get_img_size(img_to_paste)
     offset = (0, 0)
     if anchor_point == "center":
         offset = [-img_w // 2, -img_h // 2]
-    position = [x + y for x, y in zip(offset, position)]
-    main_img.paste(img_to_paste, position)
+    position = [int(x + y) for x, y in zip(offset, position)]
+
+    if isinstance(main_img, numpy.ndarray):
+        if not isinstance(img_to_paste, numpy.ndarray):
+            img_to_paste = convert_pil_to_opencv_format(img_to_paste)
+        _copy_patch_to_frame(main_img, img_to_paste, position)
+    else:
+        if isinstance(img_to_paste, numpy.ndarray):
+            img_to_paste = convert_opencv_format_to_pil(img_to_paste)
+        main_img.paste(img_to_paste, position)
+    return main_img
+
 
+def get_img_size(img):
+    """Get image size for both PIL and OpenCV-compatible instances
 
-def create_qr_code_image(code_content):
-    """Create QR code instance
+    :param img: PIL instance of image, OpenCV-compatible (NumPy array) image, either (H, W) grayscale or (H, W, C), or (N, H, W, 3) frame stack
+    :return: Tuple (w, h) in pixels
+    """
+    if isinstance(img, numpy.ndarray):
+        if img.ndim == 4:
+            return img.shape[2], img.shape[1]
+        return img.shape[1], img.shape[0]
+    return img.size
+
+
+def convert_color_to_bgr(color):
+    """Convert a PIL color specifier to the channel order used by OpenCV
+
+    :param color: Color name, hex string, RGB tuple or integer packed as 0xBBGGRR, as PIL reads it for RGB images
+    :return: Tuple (b, g, r)
+    """
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    elif isinstance(color, int):
+        return (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+    r, g, b = color[:3]
+    return b, g, r
+
+
+# The region helpers below index with a leading Ellipsis, so they work the same
+# on a single (H, W, 3) frame and on a (N, H, W, 3) frame stack
+
+
+def _clip_region_to_frame(frame, x0, y0, x1, y1):
+    if frame.ndim < 3 or frame.shape[-1] != 3:
+        raise ValueError(
+            f"Frames must be BGR arrays with 3 channels, got shape {frame.shape}"
+        )
+    # Negative NumPy indices would wrap around, clip to the frame bounds instead
+    frame_w, frame_h = get_img_size(frame)
+    return max(x0, 0), max(y0, 0), min(x1, frame_w), min(y1, frame_h)
+
+
+def _fill_frame_region(frame, x0, y0, x1, y1, bgr, opacity=1.0):
+    x0, y0, x1, y1 = _clip_region_to_frame(frame, x0, y0, x1, y1)
+    if x0 >= x1 or y0 >= y1:
+        return
+    if opacity >= 1.0:
+        frame[..., y0:y1, x0:x1, :] = bgr
+        return
+    alpha = int(round(opacity * 255))
+    premultiplied_bgr = numpy.array(bgr, dtype=numpy.uint16) * alpha
+    region = frame[..., y0:y1, x0:x1, :]
+    region[...] = (
+        premultiplied_bgr + region.astype(numpy.uint16) * (255 - alpha) + 127
+    ) // 255
+
+
+def _copy_patch_to_frame(frame, patch, position):
+    x, y = position
+    patch_h, patch_w = patch.shape[:2]
+    x0, y0, x1, y1 = _clip_region_to_frame(frame, x, y, x + patch_w, y + patch_h)
+    if x0 < x1 and y0 < y1:
+        frame[..., y0:y1, x0:x1, :] = patch[y0 - y : y1 - y, x0 - x : x1 - x]
+
+
+def _alpha_blend_sprite_arrays(frame, sprite_arrays, position):
+    premultiplied_bgr, inverse_alpha = sprite_arrays
+    x, y = position
+    patch_h, patch_w = premultiplied_bgr.shape[:2]
+    x0, y0, x1, y1 = _clip_region_to_frame(frame, x, y, x + patch_w, y + patch_h)
+    if x0 >= x1 or y0 >= y1:
+        return
+    patch_rows = slice(y0 - y, y1 - y)
+    patch_cols = slice(x0 - x, x1 - x)
+    region = frame[..., y0:y1, x0:x1, :]
+    # out = (sprite * alpha + frame * (255 - alpha)) / 255, rounded, in uint16
+    region[...] = (
+        premultiplied_bgr[patch_rows, patch_cols]
+        + region * inverse_alpha[patch_rows, patch_cols]
+        + 127
+    ) // 255
+
+
+def create_qr_code_image(
+    code_content,
+    target_width_pix=None,
+    error_correction=qrcode.constants.ERROR_CORRECT_M,
+):
+    """Create QR code instance. Codes are cached by (code_content, target_width_pix, error_correction),
+    the returned image is shared and must not be modified
 
     :param code_content: String with content to encrypt into QR
+    :param target_width_pix: Target QR code width in pixels, the code is rendered at the biggest whole module size that fits so it might end up slightly narrower. If None, qrcode's default module size is used. Defaults to None
+    :param error_correction: qrcode error correction level, defaults to qrcode.constants.ERROR_CORRECT_M
     :return: PIL instance of QR code
     """
-    return qrcode.make(code_content)
+    if target_width_pix is not None:
+        target_width_pix = int(target_width_pix)
+    return _create_qr_code_image(str(code_content), target_width_pix, error_correction)
 
 
-def find_best_font_size(text, max_width_pix, max_height_pix):
-    # Initialize font size
-    font_size = 100
-    from config import _default_font_path
+@functools.lru_cache(maxsize=_qr_code_cache_size)
+def _create_qr_code_image(code_content, target_width_pix, error_correction):
+    qr = qrcode.QRCode(error_correction=error_correction)
+    qr.add_data(code_content)
+    qr.make(fit=True)
+    if target_width_pix is not None:
+        # Whole pixels per module keep the code crisp without any resampling pass
+        qr.box_size = max(1, target_width_pix // (qr.modules_count + 2 * qr.border))
+    return qr.make_image().get_image()
 
-    font = ImageFont.truetype(str(_default_font_path), font_size)
 
-    w, h = font.getsize(text)
-    # This value would override the font size
-    while h >= max_height_pix:
-        font_size -= 1
-        font = ImageFont.truetype(str(_default_font_path), font_size)
-        w, h = font.getsize(text)
+def load_font(font_path, font_size):
+    """Load a FreeType font face. Faces are kept in a bounded LRU pool keyed by (font_path, font_size),
+    so repeated text insertions don't reload the font file
 
-    while h <= max_height_pix:
-        font_size += 1
-        font = ImageFont.truetype(str(_default_font_path), font_size)
-        w, h = font.getsize(text)
+    :param font_path: Path to .ttf font file
+    :param font_size: Font size in points
+    :return: PIL FreeTypeFont instance
+    """
+    return _load_font(str(font_path), int(font_size))
 
-    if w > max_width_pix:
-        text_fits_in_rectangle = False
-    else:
-        text_fits_in_rectangle = True
 
-    if not text_fits_in_rectangle:
-        while w >= max_width_pix:
-            font_size -= 1
-            font = ImageFont.truetype(str(_default_font_path), font_size)
-            w, h = font.getsize(text)
+@functools.lru_cache(maxsize=_font_pool_size)
+def _load_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
 
-        while w <= max_width_pix:
-            font_size += 1
-            font = ImageFont.truetype(str(_default_font_path), font_size)
-            w, h = font.getsize(text)
 
-    return font_size
+def get_text_size(text, font):
+    """Measure the size of a (possibly multiline) text rendered with a given font
+
+    :param text: String to measure
+    :param font: PIL FreeTypeFont instance
+    :return: Tuple (w, h) in pixels
+    """
+    _, _, w, h = _text_measuring_canvas.multiline_textbbox((0, 0), text, font=font)
+    return w, h
+
+
+class TextSpriteCache:
+    """Size-bounded LRU cache of rendered text sprites. Every (text, font_size, color, font_path)
+    is rasterized once into an RGBA patch, later insertions only alpha-composite the patch
+    """
+
+    def __init__(self, max_bytes=_text_sprite_cache_max_bytes):
+        """Initialize empty cache
+
+        :param max_bytes: Maximum memory footprint of the stored sprites, defaults to _text_sprite_cache_max_bytes
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._sprites = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_sprite(self, text, font_size, color, font_path):
+        """Get the RGBA sprite of a text, rendering it only if it's not cached yet.
+        The returned sprite is shared, it must not be modified
+
+        :param text: String to render
+        :param font_size: Font size in points
+        :param color: Text color
+        :param font_path: Path to .ttf font file
+        :return: PIL instance of RGBA image, the alpha channel holds the text coverage
+        """
+        return self._get_or_render(
+            ("pil", text, font_size, color, str(font_path)),
+            lambda: _render_text_sprite(text, load_font(font_path, font_size), color),
+        )
+
+    def get_sprite_arrays(self, text, font_size, color, font_path):
+        """Get the text sprite as NumPy arrays ready to be blended on BGR frames,
+        rendering it only if it's not cached yet. The returned arrays are shared, they must not be modified
+
+        :param text: String to render
+        :param font_size: Font size in points
+        :param color: Text color
+        :param font_path: Path to .ttf font file
+        :return: Tuple (premultiplied_bgr, inverse_alpha) of uint16 arrays with shapes (h, w, 3) and (h, w, 1)
+        """
+        return self._get_or_render(
+            ("numpy", text, font_size, color, str(font_path)),
+            lambda: _convert_sprite_to_arrays(
+                _render_text_sprite(text, load_font(font_path, font_size), color)
+            ),
+        )
+
+    def _get_or_render(self, key, render_sprite):
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = render_sprite()
+
+        with self._lock:
+            if key not in self._sprites:
+                self._sprites[key] = sprite
+                self.current_bytes += _get_sprite_size_in_bytes(sprite)
+            # Always keep the latest sprite, even if it exceeds the budget on its own
+            while self.current_bytes > self.max_bytes and len(self._sprites) > 1:
+                _, evicted_sprite = self._sprites.popitem(last=False)
+                self.current_bytes -= _get_sprite_size_in_bytes(evicted_sprite)
+        return sprite
+
+    def clear(self):
+        """Remove all sprites and reset hit/miss counters"""
+        with self._lock:
+            self._sprites.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def _render_text_sprite(text, font, color):
+    w, h = get_text_size(text, font)
+    coverage_mask = Image.new("L", (max(w, 1), max(h, 1)), 0)
+    ImageDraw.Draw(coverage_mask).multiline_text((0, 0), text, fill=255, font=font)
+    sprite = Image.new("RGBA", coverage_mask.size, color)
+    sprite.putalpha(coverage_mask)
+    return sprite
+
+
+def _convert_sprite_to_arrays(sprite):
+    rgba = numpy.asarray(sprite, dtype=numpy.uint16)
+    alpha = rgba[:, :, 3:]
+    premultiplied_bgr = rgba[:, :, 2::-1] * alpha
+    return premultiplied_bgr, 255 - alpha
+
+
+def _get_sprite_size_in_bytes(sprite):
+    if isinstance(sprite, tuple):
+        return sum(array.nbytes for array in sprite)
+    w, h = sprite.size
+    return w * h * 4
+
+
+text_sprite_cache = TextSpriteCache()
+
+
+def find_best_font_size(
+    text, max_width_pix, max_height_pix, font_path=_default_font_path
+):
+    """Find the biggest font size for which the text fits in a max_width_pix x max_height_pix box.
+    Results are memoized by (text, max_width_pix, max_height_pix, font_path)
+
+    :param text: String to fit
+    :param max_width_pix: Maximum text width allowed in pixels
+    :param max_height_pix: Maximum text height allowed in pixels
+    :param font_path: Path to .ttf font file, defaults to _default_font_path
+    :return: Font size in points, at least 1
+    """
+    # Text sizes are integers, flooring the limits doesn't change the result
+    # but lets float box sizes share cache entries
+    return _find_best_font_size(
+        text, int(max_width_pix), int(max_height_pix), str(font_path)
+    )
+
+
+@functools.lru_cache(maxsize=_font_fit_cache_size)
+def _find_best_font_size(text, max_width_pix, max_height_pix, font_path):
+    def text_fits(font_size):
+        w, h = get_text_size(text, load_font(font_path, font_size))
+        return w <= max_width_pix and h <= max_height_pix
+
+    # Text size grows monotonically with font size: grow the upper bound
+    # exponentially, then bisect between the last fitting size and the bound
+    lower_bound, upper_bound = 1, 2
+    while upper_bound <= _max_font_size and text_fits(upper_bound):
+        lower_bound, upper_bound = upper_bound, upper_bound * 2
+    upper_bound = min(upper_bound, _max_font_size + 1)
+
+    while upper_bound - lower_bound > 1:
+        font_size = (lower_bound + upper_bound) // 2
+        if text_fits(font_size):
+            lower_bound = font_size
+        else:
+            upper_bound = font_size
+
+    return lower_bound
@@ -4,6 +4,7 @@ from pathlib import Path
 import cv2
 
 import file_manager.file_manager as file_manager
+import frame_store
 from config import _opencv_object_trackers
 from data_processing.data_processsor_class import JsonDataProcessor
 
@@ -12,20 +13,20 @@ def navigate_frames_and_create_annotation(directory_path, tracker_type_str, targ
     """Launch a window to navigate through the frames in a directory. Draw a bounding box around the subject
     of interest and run OpenCV algorithms to automatically store the coordinates of the box on every frame
 
-    :param directory_path: Path to directory with frames
+    :param directory_path: Path to directory with PNG frames or a frame store
     :param tracker_type_str: OpenCV tracking algorithm to be used
     :param target_dir: Path to directory to store bounding box coordinates as .json
     """
     json_processor = JsonDataProcessor()
 
-    list_of_filenames = sorted(directory_path.glob("*.png"))
+    frame_sequence = frame_store.open_frame_sequence(directory_path)
     cv2.namedWindow("Frame viewer")
     cv2.moveWindow("Frame viewer", 0, 0)
 
     cv2.namedWindow("Draw Bounding Box")
     cv2.setWindowProperty("Draw Bounding Box", cv2.WND_PROP_TOPMOST, 1)
 
-    frame = cv2.imread(str(list_of_filenames[0]))
+    frame = frame_sequence[0]
     initBB = cv2.selectROI(
         "Draw Bounding Box", frame, fromCenter=False, showCrosshair=True
     )
@@ -51,8 +52,8 @@ def navigate_frames_and_create_annotation(directory_path, tracker_type_str, targ
     cv2.setWindowProperty("Frame viewer", cv2.WND_PROP_TOPMOST, 1)
     try:
         while True:
-            file_path = list_of_filenames[i]
-            frame = cv2.imread(str(file_path))
+            frame_file_name = frame_sequence.get_frame_file_name(i)
+            frame = frame_sequence[i]
 
             if frame is None:
                 break
@@ -113,8 +114,8 @@ def navigate_frames_and_create_annotation(directory_path, tracker_type_str, targ
             # if 'n' key is selected, jump to the next keyframe
             elif key == ord("n"):
                 i += 1
-                if i > len(list_of_filenames) - 1:
-                    i = len(list_of_filenames) - 1
+                if i > len(frame_sequence) - 1:
+                    i = len(frame_sequence) - 1
 
             # if 'p' key is selected, jump to the previous keyframe
             elif key == ord("p"):
@@ -146,18 +147,18 @@ def navigate_frames_and_create_annotation(directory_path, tracker_type_str, targ
             # if no key is selected (timeout passed), loop automatically to next frame
             else:
                 i += 1
-                if i > len(list_of_filenames) - 1:
-                    i = len(list_of_filenames) - 1
+                if i > len(frame_sequence) - 1:
+                    i = len(frame_sequence) - 1
 
             json_processor.json_dict = {}
             json_processor.insert_key_val_to_current_json_dict(
-                "filename", f"{file_path.name}"
+                "filename", frame_file_name
             )
             json_processor.insert_key_val_to_current_json_dict(
                 "bounding_box", [xn, yn, xn + wn, yn + hn]
             )
             json_processor.save_current_dict_to_json_file(
-                target_filename=file_path.stem,
+                target_filename=Path(frame_file_name).stem,
                 target_directory=target_dir,
                 print_output_file_path=False,
             )
@@ -171,7 +172,10 @@ if __name__ == "__main__":
         "Track a feature and store the bounding box as JSON"
     )
     parser.add_argument(
-        "-dir", nargs="?", help="Directory containing sequence of frames", type=Path
+        "-dir",
+        nargs="?",
+        help="Directory containing sequence of frames or a frame store",
+        type=Path,
     )
 
     parser.add_argument(
@@ -0,0 +1,59 @@
+import argparse
+from pathlib import Path
+
+import video_editor
+from config import _default_contact_sheet_max_thumbnails
+from file_manager import file_manager
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Create a contact sheet previewing every video in a directory"
+    )
+    parser.add_argument(
+        "-dir", nargs="?", help="Directory containing videos", type=Path
+    )
+    parser.add_argument(
+        "-tdir",
+        nargs="?",
+        help="Target dir to store contact sheets",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "-interval",
+        nargs="?",
+        help="Seconds between thumbnails, if not set, thumbnails are taken from keyframes",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "-max",
+        nargs="?",
+        help="Maximum number of thumbnails per video",
+        default=_default_contact_sheet_max_thumbnails,
+        type=int,
+    )
+    parser.add_argument(
+        "-workers",
+        nargs="?",
+        help="Number of videos processed at the same time",
+        default=None,
+        type=int,
+    )
+
+    args = parser.parse_args()
+    target_dir = args.tdir
+
+    if target_dir is None:
+        target_dir = args.dir.parents[0] / f"{args.dir.stem}_contact_sheets"
+        file_manager.create_directory(target_dir)
+
+    list_of_paths_to_videos = file_manager.list_all_video_filepaths_in_dir(args.dir)
+
+    video_editor.create_video_contact_sheets(
+        list_of_paths_to_videos=list_of_paths_to_videos,
+        target_directory=target_dir,
+        number_of_workers=args.workers,
+        seconds_between_thumbnails=args.interval,
+        max_number_of_thumbnails=args.max,
+    )
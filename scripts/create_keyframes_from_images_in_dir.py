@@ -4,6 +4,7 @@ from pathlib import Path
 import cv2
 
 import file_manager.file_manager as file_manager
+import frame_store
 from config import pr_green
 from data_processing.data_processsor_class import JsonDataProcessor
 
@@ -11,7 +12,7 @@ from data_processing.data_processsor_class import JsonDataProcessor
 def navigate_frames_and_create_keyframes(directory_path, target_dir):
     """Launch a window to navigate through the frames in a directory. Give a name to every fraction of the sequence with a dict of keyframes
 
-    :param directory_path: Path to directory with frames
+    :param directory_path: Path to directory with PNG frames or a frame store
     :param target_dir: Path to directory to store keyframe names as .json
     """
     json_processor = JsonDataProcessor()
@@ -20,9 +21,9 @@ def navigate_frames_and_create_keyframes(directory_path, target_dir):
     cv2.namedWindow("Frame viewer frame")
     cv2.moveWindow("Frame viewer", 0, 0)
 
-    list_of_filenames = sorted(directory_path.glob("*.png"))
+    frame_sequence = frame_store.open_frame_sequence(directory_path)
 
-    cv2.imshow("Frame viewer", cv2.imread(str(list_of_filenames[0])))
+    cv2.imshow("Frame viewer", frame_sequence[0])
     define_key_frame(json_processor, i)
 
     print(
@@ -41,8 +42,7 @@ def navigate_frames_and_create_keyframes(directory_path, target_dir):
     navigate_frames_automatically = False
     try:
         while True:
-            file_path = list_of_filenames[i]
-            frame = cv2.imread(str(file_path))
+            frame = frame_sequence[i]
 
             if frame is None:
                 break
@@ -65,8 +65,8 @@ def navigate_frames_and_create_keyframes(directory_path, target_dir):
             # if 'n' key is selected, jump to the next keyframe
             elif key == ord("n"):
                 i += 1
-                if i > len(list_of_filenames) - 1:
-                    i = len(list_of_filenames) - 1
+                if i > len(frame_sequence) - 1:
+                    i = len(frame_sequence) - 1
 
             # if 'p' key is selected, jump to the previous keyframe
             elif key == ord("p"):
@@ -99,8 +99,8 @@ def navigate_frames_and_create_keyframes(directory_path, target_dir):
             # if no key is selected (timeout passed), loop automatically to next frame
             else:
                 i += 1
-                if i > len(list_of_filenames) - 1:
-                    i = len(list_of_filenames) - 1
+                if i > len(frame_sequence) - 1:
+                    i = len(frame_sequence) - 1
 
         json_processor.save_current_dict_to_json_file(
             target_filename=f"{directory_path.stem}_keyframes",
@@ -143,7 +143,10 @@ if __name__ == "__main__":
         "Create a list of key frames (key=frame id, value=clip_name) and store it as JSON"
     )
     parser.add_argument(
-        "-dir", nargs="?", help="Directory containing sequence of frames", type=Path
+        "-dir",
+        nargs="?",
+        help="Directory containing sequence of frames or a frame store",
+        type=Path,
     )
 
     parser.add_argument(
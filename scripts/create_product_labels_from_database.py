@@ -1,3 +1,10 @@
+import csv
+import itertools
+import os
+from concurrent import futures
+
+from tqdm import tqdm
+
 import image_editor
 from config import (
     _a4_pixel_height_default_dpi,
@@ -6,7 +13,16 @@ from config import (
     _resources_dir_pathlib,
     _results_dir_pathlib,
 )
-from data_processing.data_processsor_class import CsvDataProcessor
+
+# Specify label width and height
+_label_width_cm, _label_height_cm = (8, 3)
+_label_width_px = int(_default_dpi * _label_width_cm / 2.54)
+_label_height_px = int(_default_dpi * _label_height_cm / 2.54)
+
+_max_label_rows = int(_a4_pixel_height_default_dpi / _label_height_px)
+_max_label_cols = int(_a4_pixel_width_default_dpi / _label_width_px)
+
+_product_database_columns = ("Product Name", "Product Model", "Product Serial Number")
 
 
 def create_product_labels(
@@ -16,8 +32,10 @@ def create_product_labels(
     product_models,
     product_serial_numbers,
     img_format="bmp",
+    max_workers=None,
 ):
     """Create printable labels with QR codes to identify products in a database.
+    Every A4 page is rendered and saved in its own worker process as {target_file_name}_{page number}
 
     :param target_directory: Path to store created labels
     :param target_file_name: Name for the created file with labels without suffix
@@ -25,127 +43,189 @@ def create_product_labels(
     :param product_models: List of product models
     :param product_serial_numbers: List of product serial numbers
     :param img_format: Image format to save created labels, defaults to "bmp"
+    :param max_workers: Number of worker processes rendering pages, if None, as many as CPUs. Defaults to None
+    """
+    create_product_labels_from_rows(
+        target_directory,
+        target_file_name,
+        zip(product_names, product_models, product_serial_numbers),
+        img_format=img_format,
+        max_workers=max_workers,
+    )
+
+
+def create_product_labels_from_rows(
+    target_directory,
+    target_file_name,
+    product_rows,
+    img_format="bmp",
+    max_workers=None,
+):
+    """Create printable labels from a stream of product rows. Pages are submitted to the worker processes
+    as soon as they are full, and only a few pages are kept in flight, so memory stays flat and the first
+    pages are saved before the whole product database has been read
+
+    :param target_directory: Path to store created labels
+    :param target_file_name: Name for the created file with labels without suffix
+    :param product_rows: Iterable of tuples (product_name, product_model, product_serial_number)
+    :param img_format: Image format to save created labels, defaults to "bmp"
+    :param max_workers: Number of worker processes rendering pages, if None, as many as CPUs. Defaults to None
+    """
+    max_workers = max_workers or os.cpu_count()
+    max_pages_in_flight = 2 * max_workers
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pages_in_flight = set()
+        with tqdm(unit="page") as progressbar:
+            for page_number, page_products in enumerate(iter_label_pages(product_rows)):
+                if len(pages_in_flight) >= max_pages_in_flight:
+                    done, pages_in_flight = futures.wait(
+                        pages_in_flight, return_when=futures.FIRST_COMPLETED
+                    )
+                    for finished_page in done:
+                        finished_page.result()
+                    progressbar.update(len(done))
+                pages_in_flight.add(
+                    pool.submit(
+                        render_label_page,
+                        page_products,
+                        page_number,
+                        target_directory,
+                        target_file_name,
+                        img_format,
+                    )
+                )
+            for finished_page in futures.as_completed(pages_in_flight):
+                finished_page.result()
+                progressbar.update(1)
+
+
+def iter_label_pages(product_rows):
+    """Group a stream of products in A4 pages, every page holds a grid of labels
+
+    :param product_rows: Iterable of tuples (product_name, product_model, product_serial_number)
+    :return: Generator of pages, every page is a list of products
+    """
+    labels_per_page = _max_label_rows * _max_label_cols
+    product_rows = iter(product_rows)
+    while True:
+        page_products = list(itertools.islice(product_rows, labels_per_page))
+        if not page_products:
+            return
+        yield page_products
+
+
+def iter_csv_rows(path_to_csv, list_of_columns):
+    """Stream the rows of a CSV file one by one, keeping only the requested columns.
+    CsvDataProcessor loads the whole file into a dataframe, so it is not used here
+
+    :param path_to_csv: Path to CSV file
+    :param list_of_columns: Names of the columns to keep, in output order
+    :return: Generator of tuples with one value per requested column
+    """
+    with open(path_to_csv, newline="") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader)
+        column_indices = [header.index(column) for column in list_of_columns]
+        for row in csv_reader:
+            yield tuple(row[index] for index in column_indices)
+
+
+def render_label_page(
+    page_products, page_number, target_directory, target_file_name, img_format
+):
+    """Render a single A4 page of labels and save it
+
+    :param page_products: List of tuples (product_name, product_model, product_serial_number) in the page
+    :param page_number: Page number, used in the file name
+    :param target_directory: Path to store created labels
+    :param target_file_name: Name for the created file with labels without suffix
+    :param img_format: Image format to save created labels
     """
-    # Specify label width and height
-    label_width_cm, label_height_cm = (8, 3)
-    label_width_inch, label_height_inch = (
-        label_width_cm / 2.54,
-        label_height_cm / 2.54,
+    product_labels_img = image_editor.create_blank_image(
+        size=(_a4_pixel_width_default_dpi, _a4_pixel_height_default_dpi)
     )
 
-    label_width_px = int(_default_dpi * label_width_inch)
-    label_height_px = int(_default_dpi * label_height_inch)
-
-    max_label_rows = int(_a4_pixel_height_default_dpi / label_height_px)
-    max_label_cols = int(_a4_pixel_width_default_dpi / label_width_px)
-
-    # Create grid of labels, create additional files if they don't fit in a single A4
-    i = 0
-    j = 0
-    for index in len(product_names):
-        if i == 0 and j == 0:
-            product_labels_img = image_editor.create_blank_image(
-                size=(_a4_pixel_width_default_dpi, _a4_pixel_height_default_dpi)
-            )
-
-        if i == max_label_rows:
-            j += 1
-            i = 0
-        if j == max_label_cols:
-            j = 0
-            i = 0
-            image_editor.save_img(
-                img=product_labels_img,
-                target_file_name=target_file_name,
-                target_directory=target_directory,
-                img_format=img_format,
-                dpi=(_default_dpi, _default_dpi),
-            )
-
-        # Draw label rectangle
-        image_editor.insert_rectangle(
-            img=product_labels_img,
-            rectangle_fill_color="white",
-            position=(j * label_width_px, i * label_height_px),
-            rectangle_height=label_height_px,
-            rectangle_width=label_width_px,
-            outline_color="black",
-            outline_width=2,
-        )
-
-        # Create text field with product name, model and serial_number
-        product_name = product_names[index]
-        product_model = product_models[index]
-        product_serial_number = product_serial_numbers[index]
-        max_text_width_pix = int(label_width_px * 0.75)
-        offset_from_label_corners = int(label_width_px * 0.02)
-        image_editor.insert_text(
-            img=product_labels_img,
-            text=f"{product_name}\n\nModel: {product_model}\nSN:{product_serial_number}",
-            color="black",
-            position=(
-                j * label_width_px + offset_from_label_corners,
-                i * label_height_px + offset_from_label_corners,
-            ),
-            max_width_pix=max_text_width_pix,
-            max_height_pix=label_height_px,
-        )
-
-        # Create QR code to serve as unique product identifier
-        qr_img = image_editor.create_qr_code_image(
-            code_content=f"{product_serial_number}"
-        )
-
-        desired_qr_code_width_pix = (label_width_px - max_text_width_pix) * 0.8
-
-        qr_code_w, _ = qr_img.size
-
-        barcode_resizing_factor = desired_qr_code_width_pix / qr_code_w
-
-        image_editor.paste_img(
-            main_img=product_labels_img,
-            img_to_paste=qr_img,
-            position=(
-                j * label_width_px
-                + max_text_width_pix
-                + offset_from_label_corners
-                + int(desired_qr_code_width_pix / 2),
-                i * label_height_px + int(label_height_px / 2),
-            ),
-            resizing_factor=barcode_resizing_factor,
-            anchor_point="center",
-        )
-
-        i += 1
+    # Labels fill the page column by column
+    for index, product in enumerate(page_products):
+        j, i = divmod(index, _max_label_rows)
+        insert_label(product_labels_img, product, i, j)
+
     image_editor.save_img(
         img=product_labels_img,
-        target_file_name=target_file_name,
+        target_file_name=f"{target_file_name}_{str(page_number).zfill(4)}",
         target_directory=target_directory,
         img_format=img_format,
         dpi=(_default_dpi, _default_dpi),
+        overwrite=True,
     )
 
 
-if __name__ == "__main__":
-    dataprocessor = CsvDataProcessor(_results_dir_pathlib)
-    dataprocessor.fetch_csv_data_from_file_into_dataframe(
-        _resources_dir_pathlib / "example_product_database.csv"
+def insert_label(product_labels_img, product, i, j):
+    """Draw a single product label on a page
+
+    :param product_labels_img: PIL instance of the page
+    :param product: Tuple (product_name, product_model, product_serial_number)
+    :param i: Label row in the page grid
+    :param j: Label column in the page grid
+    """
+    product_name, product_model, product_serial_number = product
+
+    # Draw label rectangle
+    image_editor.insert_rectangle(
+        img=product_labels_img,
+        rectangle_fill_color="white",
+        position=(j * _label_width_px, i * _label_height_px),
+        rectangle_height=_label_height_px,
+        rectangle_width=_label_width_px,
+        outline_color="black",
+        outline_width=2,
     )
 
-    target_dir = _results_dir_pathlib
-    target_file_name = "example_product_labels"
-    product_name_list = dataprocessor.get_list_of_all_elements_in_column("Product Name")
-    product_model_list = dataprocessor.get_list_of_all_elements_in_column(
-        "Product Model"
+    # Create text field with product name, model and serial_number
+    max_text_width_pix = int(_label_width_px * 0.75)
+    offset_from_label_corners = int(_label_width_px * 0.02)
+    image_editor.insert_text(
+        img=product_labels_img,
+        text=f"{product_name}\n\nModel: {product_model}\nSN:{product_serial_number}",
+        color="black",
+        position=(
+            j * _label_width_px + offset_from_label_corners,
+            i * _label_height_px + offset_from_label_corners,
+        ),
+        max_width_pix=max_text_width_pix,
+        max_height_pix=_label_height_px - 2 * offset_from_label_corners,
+    )
+
+    # Create QR code to serve as unique product identifier, rendered straight at
+    # the label size so it doesn't need to be resized
+    desired_qr_code_width_pix = (_label_width_px - max_text_width_pix) * 0.8
+
+    qr_img = image_editor.create_qr_code_image(
+        code_content=f"{product_serial_number}",
+        target_width_pix=desired_qr_code_width_pix,
     )
-    product_serial_number_list = dataprocessor.get_list_of_all_elements_in_column(
-        "Product Serial Number"
+
+    image_editor.paste_img(
+        main_img=product_labels_img,
+        img_to_paste=qr_img,
+        position=(
+            j * _label_width_px
+            + max_text_width_pix
+            + offset_from_label_corners
+            + int(desired_qr_code_width_pix / 2),
+            i * _label_height_px + int(_label_height_px / 2),
+        ),
+        anchor_point="center",
     )
 
-    create_product_labels(
-        target_dir,
-        target_file_name,
-        product_name_list,
-        product_model_list,
-        product_serial_number_list,
+
+if __name__ == "__main__":
+    target_dir = _results_dir_pathlib
+    target_file_name = "example_product_labels"
+
+    product_rows = iter_csv_rows(
+        _resources_dir_pathlib / "example_product_database.csv",
+        _product_database_columns,
     )
+
+    create_product_labels_from_rows(target_dir, target_file_name, product_rows)
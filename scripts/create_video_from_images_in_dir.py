@@ -3,7 +3,7 @@ from pathlib import Path
 
 import file_manager
 import video_editor
-from config import _default_frame_rate
+from config import _default_ffmpeg_encoder_preset, _default_frame_rate
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -28,6 +28,27 @@ if __name__ == "__main__":
         help="freeze last frames for a second",
         action="store_true",
     )
+    parser.add_argument(
+        "-encoder",
+        nargs="?",
+        help="Video encoder, ffmpeg encodes in its own process and freezes frames without duplicates. Defaults to ffmpeg if it's installed",
+        choices=["opencv", "ffmpeg"],
+        default=None,
+    )
+    parser.add_argument(
+        "-preset",
+        nargs="?",
+        help="libx264 preset of the ffmpeg encoder",
+        default=_default_ffmpeg_encoder_preset,
+        type=str,
+    )
+    parser.add_argument(
+        "-threads",
+        nargs="?",
+        help="Number of threads of the ffmpeg encoder, 0 lets ffmpeg decide",
+        default=0,
+        type=int,
+    )
 
     args = parser.parse_args()
     target_dir = args.tdir
@@ -49,6 +70,9 @@ if __name__ == "__main__":
         freeze_last_frame=freeze_bool,
         seconds_freezing_frame=1,
         insert_subtitles=False,
+        encoder=args.encoder,
+        encoder_preset=args.preset,
+        encoder_threads=args.threads,
     )
 
     file_manager.show_file(video)
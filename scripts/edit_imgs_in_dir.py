@@ -1,9 +1,11 @@
 import argparse
+import itertools
 from concurrent import futures
 from pathlib import Path
 
 from tqdm import tqdm
 
+import directory_index
 import file_manager.file_manager as file_manager
 import image_editor
 
@@ -32,6 +34,17 @@ def edit_img(img_path, target_output_dir):
     )
 
 
+def strip_img_metadata(img_path, target_output_dir):
+    """Strip EXIF, XMP and ICC metadata from an image without decoding its pixels
+
+    :param img_path: Path to input image
+    :param target_output_dir: Path to store stripped image
+    """
+    image_editor.strip_metadata_from_file(
+        img_path, target_file_name=img_path.stem, target_directory=target_output_dir
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Manipulate images in a directory")
     parser.add_argument(
@@ -44,6 +57,11 @@ if __name__ == "__main__":
         type=Path,
         default=None,
     )
+    parser.add_argument(
+        "-onlystrip",
+        help="only strip image metadata, skipping any other edit",
+        action="store_true",
+    )
 
     args = parser.parse_args()
     target_dir = args.tdir
@@ -53,11 +71,14 @@ if __name__ == "__main__":
 
     file_manager.create_directory(target_dir)
 
-    list_of_files = file_manager.list_all_image_filepaths_in_dir(args.dir)
+    # Every image is edited on its own, so files are taken in directory order without sorting them
+    edit_function = strip_img_metadata if args.onlystrip else edit_img
 
     with futures.ProcessPoolExecutor() as pool:
-        with tqdm(total=len(list_of_files)) as progressbar:
+        with tqdm(unit="img") as progressbar:
             for _ in pool.map(
-                edit_img, list_of_files, [target_dir] * len(list_of_files)
+                edit_function,
+                directory_index.iter_files_in_dir(args.dir),
+                itertools.repeat(target_dir),
             ):
                 progressbar.update(1)
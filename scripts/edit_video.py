@@ -1,16 +1,19 @@
 import argparse
+import functools
+import os
 from pathlib import Path
 
 import cv2
-import tqdm
 
+import directory_index
 import file_manager.file_manager as file_manager
+import frame_pipeline
 import image_editor
 import video_editor
 from config import _default_frame_rate
 
 
-def edit_video(video_path, target_directory, target_filename):
+def edit_video(video_path, target_directory, target_filename, number_of_workers=None):
     """Custom method to modify a video as you wish. Since the scope is very broad, you should edit the script and tailor it to your objectives.
     Some examples of the method capabilities:
         - Instert a subtitle to the video
@@ -19,50 +22,49 @@ def edit_video(video_path, target_directory, target_filename):
     :param video_path: Path to video file
     :param target_directory: Target directory to store modified video file
     :param target_filename: Target name for the modified video file, without suffix
+    :param number_of_workers: Number of threads editing frames, if None, as many as CPUs. Defaults to None
     """
+    number_of_workers = number_of_workers or os.cpu_count()
 
-    # Insert any video operations here
-    Video1 = video_editor.convert_video_frame_rate(
-        path_to_video=video_path,
-        target_fps=_default_frame_rate,
-        target_directory=target_directory,
-        target_file_name=f"{video_path.stem}_{_default_frame_rate}fps{video_path.suffix}",
-    )
-    cap1 = cv2.VideoCapture(str(Video1))
+    # Insert any video operations here as pipeline stages
     target_frame_rate = 10
     subtitle = file_name
+    list_of_stages = []
+    if subtitle:
+        # The same subtitle goes on every frame, so it's drawn on whole frame stacks at once
+        list_of_stages.append(
+            frame_pipeline.FrameStackStage(
+                functools.partial(
+                    image_editor.insert_subtitle_on_frame_stack, text=subtitle
+                ),
+                number_of_workers=number_of_workers,
+            )
+        )
+
+    video_properties = video_editor.probe_video(video_path)
+    size = video_editor.get_video_display_size(video_path)
+    fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
 
     # Save file
-    target_file_path = file_manager.find_new_unique_file_path(
-        target_file_path=target_directory / f"{target_filename}.mp4"
+    target_file_path = directory_index.reserve_unique_file_path(
+        target_directory / f"{target_filename}.mp4"
     )
 
-    fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
-    videowriter = None
-    num_frames_vid = int(cap1.get(cv2.CAP_PROP_FRAME_COUNT))
-    for i in tqdm.tqdm(range(num_frames_vid)):
-        if i < num_frames_vid:
-            _, frame1 = cap1.read()
-
-        if i == (num_frames_vid):
-            break
-
-        img = image_editor.convert_opencv_format_to_pil(frame1)
-        if subtitle:
-            image_editor.insert_subtitle(img=img, text=subtitle)
-
-        if videowriter is None:
-            size = img.size
-            videowriter = cv2.VideoWriter(
-                str(target_file_path), fourcc, target_frame_rate, size
-            )
-        img = image_editor.convert_pil_to_opencv_format(img)
-
-        videowriter.write(img)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            cv2.destroyAllWindows()
-            break
-    file_manager.move_file_to_trash(Video1)
+    # Frames are resampled to the default frame rate while decoding, without an intermediate video
+    try:
+        frame_pipeline.run_frame_pipeline(
+            frame_pipeline.iter_video_file_frames(
+                video_path, target_fps=_default_frame_rate
+            ),
+            list_of_stages,
+            cv2.VideoWriter(str(target_file_path), fourcc, target_frame_rate, size),
+            total_number_of_frames=int(
+                round(video_properties["duration"] * _default_frame_rate)
+            ),
+        )
+    except BaseException:
+        directory_index.release_reserved_file_path(target_file_path)
+        raise
 
 
 if __name__ == "__main__":
@@ -10,6 +10,27 @@ if __name__ == "__main__":
     parser.add_argument(
         "-tdir", nargs="?", help="Target dir to store frames", type=Path, default=None
     )
+    parser.add_argument(
+        "-workers",
+        nargs="?",
+        help="Number of processes decoding video segments in parallel",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-backend",
+        nargs="?",
+        help="Frame extraction backend",
+        choices=["opencv", "ffmpeg"],
+        default="opencv",
+    )
+    parser.add_argument(
+        "-format",
+        nargs="?",
+        help="Write frames as PNG files or as a frame store",
+        choices=["png", "frame_store"],
+        default="png",
+    )
 
     args = parser.parse_args()
     path_to_video = args.vid
@@ -20,6 +41,9 @@ if __name__ == "__main__":
 
     video_editor.extract_frames_from_video(
         path_to_video=path_to_video,
-        target_directory=target_dir
+        target_directory=target_dir,
+        number_of_workers=args.workers,
+        backend=args.backend,
+        output_format=args.format,
         # frame_prefix="test"
     )
@@ -5,16 +5,17 @@ from pathlib import Path
 import tqdm
 
 import file_manager.file_manager as file_manager
+import frame_store
 import image_editor
 from config import pr_red
 
 
 def insert_timestamps_on_frame_sequence_in_dir(
-    list_of_files, target_directory, json_keyframes_file, fps
+    frame_sequence, target_directory, json_keyframes_file, fps
 ):
     """Insert timestamps on a sequence of frames as a legend
 
-    :param list_of_files: List of paths to frames
+    :param frame_sequence: Sequence of frames, as returned by frame_store.open_frame_sequence
     :param target_directory: Path to store edited frames
     :param json_keyframes_file: Path to JSON dict with keyframes
     :param fps: Frame rate at which the frame sequence was captured
@@ -25,14 +26,15 @@ def insert_timestamps_on_frame_sequence_in_dir(
     time_measurements_tracker = dict.fromkeys(set(json_keyframes.values()), 0.0)
 
     j = 0
-    for i, file_path in tqdm.tqdm(enumerate(list_of_files), total=len(list_of_files)):
+    for i, frame in tqdm.tqdm(enumerate(frame_sequence), total=len(frame_sequence)):
         try:
             frame_main_title = json_keyframes[str(i)]
             j = 0
         except KeyError:
             time_measurements_tracker[frame_main_title] += 1.0 / fps
 
-        img = image_editor.open_image(file_path)
+        # Frames from a frame store are read-only views of the store
+        img = frame if frame.flags.writeable else frame.copy()
 
         time_tracker_str = ""
         for value in sorted(set(json_keyframes.values())):
@@ -41,7 +43,7 @@ def insert_timestamps_on_frame_sequence_in_dir(
             except KeyError:
                 time_tracker_str += f"\nTotal {value}: {round(0.0, 3):.3f} seconds"
 
-        img_w, img_h = img.size
+        img_w, img_h = image_editor.get_img_size(img)
         image_editor.insert_text_box(
             img=img,
             text=f"{frame_main_title}...\n"
@@ -71,7 +73,10 @@ if __name__ == "__main__":
         "Insert timestamps on a sequence of frames in a directory"
     )
     parser.add_argument(
-        "-dir", nargs="?", help="Directory containing images", type=Path
+        "-dir",
+        nargs="?",
+        help="Directory containing images or a frame store",
+        type=Path,
     )
     parser.add_argument(
         "-tdir",
@@ -98,7 +103,7 @@ if __name__ == "__main__":
         target_dir = args.dir.parents[0] / f"{args.dir.stem}_edited_frames"
         file_manager.create_directory(target_dir)
 
-    list_of_files = file_manager.list_all_pngs_in_dir(args.dir)
+    frame_sequence = frame_store.open_frame_sequence(args.dir)
 
     try:
         fps = int(re.findall("_(\d+)FPS", str(args.dir))[0])
@@ -113,9 +118,11 @@ if __name__ == "__main__":
             )
         )
 
-    insert_timestamps_on_frame_sequence_in_dir(
-        list_of_files=list_of_files,
-        target_directory=target_dir,
-        json_keyframes_file=args.json,
-        fps=fps,
-    )
+    # PNG encoding runs in background threads while the next frames are drawn
+    with image_editor.async_img_writing():
+        insert_timestamps_on_frame_sequence_in_dir(
+            frame_sequence=frame_sequence,
+            target_directory=target_dir,
+            json_keyframes_file=args.json,
+            fps=fps,
+        )
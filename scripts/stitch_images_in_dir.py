@@ -1,6 +1,7 @@
 import argparse
 from pathlib import Path
 
+import directory_index
 import file_manager.file_manager as file_manager
 import image_editor
 
@@ -33,18 +34,15 @@ if __name__ == "__main__":
     if file_name is None:
         file_name = args.dir.stem
 
-    list_of_imgs = []
-
-    for img_path in file_manager.list_all_image_filepaths_in_dir(args.dir):
-        list_of_imgs.append(image_editor.open_image(img_path))
+    list_of_img_paths = directory_index.list_files_in_dir(args.dir)
 
     if args.nosubs:
         list_of_subtitles = None
     else:
-        list_of_subtitles = file_manager.list_all_image_filenames_in_dir(args.dir)
+        list_of_subtitles = [img_path.stem for img_path in list_of_img_paths]
 
-    comp = image_editor.stitch_images_side_by_side(
-        list_of_imgs=list_of_imgs, list_of_subtitles=list_of_subtitles
+    comp = image_editor.stitch_image_files_side_by_side(
+        list_of_img_paths=list_of_img_paths, list_of_subtitles=list_of_subtitles
     )
 
     image_editor.save_img(
@@ -38,6 +38,13 @@ if __name__ == "__main__":
     parser.add_argument(
         "-noaudio", help="remove audio from final composition", action="store_true"
     )
+    parser.add_argument(
+        "-segments",
+        nargs="?",
+        help="Number of timeline segments rendered in parallel",
+        default=1,
+        type=int,
+    )
 
     args = parser.parse_args()
     target_dir = args.tdir
@@ -63,4 +70,5 @@ if __name__ == "__main__":
         last_frame_freeze_duration=args.fd,
         insert_timers=args.timers,
         remove_audio=args.noaudio,
+        number_of_segments=args.segments,
     )
@@ -1,12 +1,32 @@
+import bisect
+import fractions
+import functools
+import hashlib
+import json
+import os
+import shutil
 import subprocess
+import threading
+from concurrent import futures
+from pathlib import Path
 
 import cv2
+import numpy
 import tqdm
 
+import directory_index
+import frame_pipeline
+import frame_store
 import image_editor
 from config import (
-    _1_minute_timer_video_path,
+    _cache_dir_pathlib,
+    _default_contact_sheet_columns,
+    _default_contact_sheet_max_thumbnails,
+    _default_contact_sheet_thumbnail_width,
+    _default_ffmpeg_encoder_preset,
     _default_font_path,
+    _default_frame_prefetch_size,
+    _default_frame_stack_size,
     _default_subtitle_height_percentage,
     _ffmpeg_path,
     _ffprobe_path,
@@ -15,6 +35,12 @@ from config import (
 )
 from file_manager import file_manager
 
+_video_probes_dir_pathlib = _cache_dir_pathlib / "video_probes"
+_video_probes = {}
+_video_probes_lock = threading.Lock()
+# Bumped when the probed properties change, so older cached probes are ignored
+_video_probe_cache_version = 2
+
 
 def create_video_from_frames_in_dir(
     path_to_directory,
@@ -25,104 +51,809 @@ def create_video_from_frames_in_dir(
     freeze_last_frame=False,
     seconds_freezing_frame=2,
     insert_subtitles=False,
+    encoder=None,
+    encoder_preset=_default_ffmpeg_encoder_preset,
+    encoder_threads=0,
+    prefetch_size=_default_frame_prefetch_size,
 ):
-    """Compose video from frame sequence in directory
+    """Compose video from frame sequence in directory. Frames go through a frame_pipeline: a thread pool
+    decodes them ahead of the encoder, drawing subtitles only if requested
 
     :param path_to_directory: Path to directory with frames
     :param target_directory: Target directory to store composed video
     :param target_video_name: Target name for composed video
     :param fps: Target video frame rate
-    :param frames_to_freeze: List of keyframes ids to be frozen, defaults to None
+    :param frames_to_freeze: List of indices of the frames to be frozen, defaults to None
     :param freeze_last_frame: Flag to freeze last frames of the video, defaults to False
     :param seconds_freezing_frame: Time in secods freezing frames, defaults to 2
     :param insert_subtitles: Flag to insert subtitles based on the frame name, defaults to False
+    :param encoder: "opencv" to encode with cv2.VideoWriter, or "ffmpeg" to stream raw frames to an FFMPEG libx264 encoder. The "ffmpeg" encoder freezes frames by delaying the timestamps of the next frames instead of encoding duplicates. If None, "ffmpeg" is used when FFMPEG is installed, otherwise "opencv". Defaults to None
+    :param encoder_preset: libx264 preset of the "ffmpeg" encoder, defaults to _default_ffmpeg_encoder_preset
+    :param encoder_threads: Number of threads of the "ffmpeg" encoder, 0 lets FFMPEG decide. Defaults to 0
+    :param prefetch_size: Number of frames decoded ahead of the encoder, defaults to _default_frame_prefetch_size
     :return: Path to converted video
     """
+    if encoder is None:
+        encoder = "ffmpeg" if shutil.which(str(_ffmpeg_path)) else "opencv"
+    if encoder not in ("opencv", "ffmpeg"):
+        raise ValueError(f"Unknown video encoder {encoder}")
+
     file_manager.create_directory(target_directory)
-    target_video_path = file_manager.find_new_unique_file_path(
+    target_video_path = directory_index.reserve_unique_file_path(
         target_directory / f"{target_video_name}.mp4"
     )
 
-    list_of_files = file_manager.list_all_pngs_in_dir(path_to_directory)
+    try:
+        list_of_files = directory_index.list_all_pngs_in_dir(path_to_directory)
+        number_of_freezing_frames = int(seconds_freezing_frame * fps)
+
+        print("\nConstructing video...")
+        # cv2.imread releases the GIL, so the decoding threads run in parallel
+        frame_pipeline.run_frame_pipeline(
+            list_of_files,
+            [
+                frame_pipeline.FrameStage(
+                    functools.partial(
+                        _read_frame_file, insert_subtitles=insert_subtitles
+                    ),
+                    number_of_workers=os.cpu_count(),
+                    max_pending_frames=prefetch_size,
+                )
+            ],
+            _FrameSequenceVideoWriter(
+                target_video_path,
+                fps,
+                encoder,
+                encoder_preset,
+                encoder_threads,
+                frame_holds=dict.fromkeys(
+                    frames_to_freeze or (), number_of_freezing_frames
+                ),
+                last_frame_hold=number_of_freezing_frames if freeze_last_frame else 0,
+                number_of_frames=len(list_of_files),
+            ),
+            total_number_of_frames=len(list_of_files),
+        )
+    except BaseException:
+        directory_index.release_reserved_file_path(target_video_path)
+        raise
+    return target_video_path
+
 
-    img = cv2.imread(str(list_of_files[0]))
+def _read_frame_file(file_path, insert_subtitles):
+    img = cv2.imread(str(file_path))
+    if img is None:
+        raise IOError(f"Could not read {file_path}")
+    if insert_subtitles:
+        image_editor.insert_subtitle(
+            img=img,
+            text=file_path.stem,
+            color="white",
+            subtitle_height_percentage=_default_subtitle_height_percentage,
+        )
+    return img
 
-    height, width, layers = img.shape
-    size = (width, height)
 
-    out = cv2.VideoWriter(
-        str(target_video_path),
-        cv2.VideoWriter_fourcc(*"avc1"),
+class _FrameSequenceVideoWriter:
+    """Frame sink of create_video_from_frames_in_dir. The encoder is opened with the size of the first
+    frame, and frozen frames are written as duplicates with the "opencv" encoder or held through their
+    timestamps with the "ffmpeg" encoder
+    """
+
+    def __init__(
+        self,
+        target_video_path,
         fps,
-        size,
-        isColor=True,
-    )
+        encoder,
+        encoder_preset,
+        encoder_threads,
+        frame_holds,
+        last_frame_hold,
+        number_of_frames,
+    ):
+        """
+        :param target_video_path: Path to encoded video
+        :param fps: Video frame rate
+        :param encoder: "opencv" or "ffmpeg"
+        :param encoder_preset: libx264 preset of the "ffmpeg" encoder
+        :param encoder_threads: Number of threads of the "ffmpeg" encoder
+        :param frame_holds: Dict {frame index: number of extra frame durations the frame stays on screen}
+        :param last_frame_hold: Number of extra frame durations the last frame stays on screen
+        :param number_of_frames: Number of frames in the sequence
+        """
+        self.target_video_path = target_video_path
+        self.fps = fps
+        self.encoder = encoder
+        self.encoder_preset = encoder_preset
+        self.encoder_threads = encoder_threads
+        self.frame_holds = frame_holds
+        self.last_frame_hold = last_frame_hold
+        self.last_frame_index = number_of_frames - 1
+        self.video_writer = None
+        self.frame_index = 0
+        self.last_frame = None
+
+    def write(self, img):
+        if self.video_writer is None:
+            self.video_writer = self._open_video_writer(img)
+        self.video_writer.write(img)
+        if self.encoder == "opencv":
+            for _ in range(self.frame_holds.get(self.frame_index, 0)):
+                self.video_writer.write(img)
+        self.last_frame = img
+        self.frame_index += 1
+
+    def release(self):
+        if self.video_writer is None:
+            return
+        if self.last_frame_hold > 0:
+            # The "ffmpeg" encoder holds the last frame, then shows a single duplicate of it
+            for _ in range(self.last_frame_hold if self.encoder == "opencv" else 1):
+                self.video_writer.write(self.last_frame)
+        self.video_writer.release()
+
+    def _open_video_writer(self, img):
+        height, width, layers = img.shape
+        size = (width, height)
+        if self.encoder == "opencv":
+            return cv2.VideoWriter(
+                str(self.target_video_path),
+                cv2.VideoWriter_fourcc(*"avc1"),
+                self.fps,
+                size,
+                isColor=True,
+            )
 
-    print("\nConstructing video...")
-    for file_path in tqdm.tqdm(list_of_files, total=len(list_of_files)):
-        img = image_editor.open_image(file_path)
-        if insert_subtitles:
-            image_editor.insert_subtitle(
-                img=img,
-                text=file_path.stem,
-                color="white",
-                subtitle_height_percentage=_default_subtitle_height_percentage,
+        frame_holds = dict(self.frame_holds)
+        if self.last_frame_hold > 0:
+            frame_holds[self.last_frame_index] = (
+                frame_holds.get(self.last_frame_index, 0) + self.last_frame_hold - 1
             )
+        return FfmpegVideoWriter(
+            self.target_video_path,
+            self.fps,
+            size,
+            preset=self.encoder_preset,
+            threads=self.encoder_threads,
+            frame_holds=frame_holds,
+        )
 
-        img = image_editor.convert_pil_to_opencv_format(img=img)
 
-        out.write(img)
+class FfmpegVideoWriter:
+    """Drop-in replacement for cv2.VideoWriter streaming raw BGR frames to an FFMPEG libx264 encoder,
+    which runs in its own process with as many threads as requested. Frames can be held on screen
+    longer than one frame duration through their timestamps, making the video variable frame rate
+    """
 
-        if frames_to_freeze is not None:
-            for _ in range(seconds_freezing_frame * fps):
-                out.write(img)
+    def __init__(
+        self,
+        target_video_path,
+        fps,
+        size,
+        preset=_default_ffmpeg_encoder_preset,
+        threads=0,
+        frame_holds=None,
+    ):
+        """
+        :param target_video_path: Path to encoded video
+        :param fps: Video frame rate
+        :param size: Frame size (w, h) in pixels
+        :param preset: libx264 preset, defaults to _default_ffmpeg_encoder_preset
+        :param threads: Number of encoder threads, 0 lets FFMPEG decide. Defaults to 0
+        :param frame_holds: Dict {frame index: number of extra frame durations the frame stays on screen}, defaults to None
+        """
+        width, height = size
+        self.frame_shape = (height, width, 3)
+        # yuv420p needs even dimensions
+        video_filters = ["pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        encoder_options = []
+        if frame_holds:
+            # Every frame is delayed by the holds of all the frames before it
+            timestamp_shifts = "".join(
+                f"+{number_of_frames}*gte(N,{frame_index + 1})"
+                for frame_index, number_of_frames in sorted(frame_holds.items())
+                if number_of_frames > 0
+            )
+            video_filters.append(f"setpts='(N{timestamp_shifts})/(FRAME_RATE*TB)'")
+            # Without B-frames decoding timestamps follow the held presentation timestamps,
+            # otherwise the MP4 duration, computed from decoding timestamps, ends too early
+            encoder_options = ["-bf", "0"]
+        self.ffmpeg_process = subprocess.Popen(
+            [
+                _ffmpeg_path,
+                "-v",
+                "error",
+                "-y",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "bgr24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(fps),
+                "-i",
+                "pipe:0",
+                "-vf",
+                ",".join(video_filters),
+                "-vsync",
+                "vfr",
+                "-c:v",
+                "libx264",
+                *encoder_options,
+                "-preset",
+                preset,
+                "-threads",
+                str(threads),
+                "-pix_fmt",
+                "yuv420p",
+                str(target_video_path),
+            ],
+            stdin=subprocess.PIPE,
+        )
 
-    if freeze_last_frame:
-        for _ in range(seconds_freezing_frame * fps):
-            out.write(img)
+    def write(self, img):
+        """Send a frame to the encoder
 
-    out.release()
-    return target_video_path
+        :param img: OpenCV-compatible (BGR NumPy array) frame of the writer size
+        """
+        # FFMPEG reads a fixed number of bytes per frame, a frame of another size would shift all the next ones
+        if img.shape != self.frame_shape:
+            raise ValueError(
+                f"Frame of shape {img.shape} doesn't match the writer frame shape {self.frame_shape}"
+            )
+        self.ffmpeg_process.stdin.write(numpy.ascontiguousarray(img).data)
+
+    def release(self):
+        """Close the stream and wait for the encoder to finish the video"""
+        self.ffmpeg_process.stdin.close()
+        if self.ffmpeg_process.wait() != 0:
+            raise subprocess.CalledProcessError(
+                self.ffmpeg_process.returncode, self.ffmpeg_process.args
+            )
 
 
-def extract_frames_from_video(path_to_video, target_directory, frame_prefix=""):
-    """Extract frames from video
+def extract_frames_from_video(
+    path_to_video,
+    target_directory,
+    frame_prefix="",
+    number_of_workers=1,
+    backend="opencv",
+    output_format="png",
+):
+    """Extract frames from video, writing every frame as soon as it's decoded
 
     :param path_to_video: Path to video
     :param target_directory: Target directory to store extracted frames
     :param frame_prefix: The default naming for the frames is their index, you can define a custom prefix here, defaults to ""
+    :param number_of_workers: Number of processes decoding the video with the "opencv" backend. If greater than 1, the video is split in keyframe-aligned segments decoded in parallel, producing the same frames as serial extraction. Variable frame rate videos, or videos whose segments can't be seeked exactly, are extracted serially. Defaults to 1
+    :param backend: "opencv" to decode and write frames from Python, or "ffmpeg" to let FFMPEG decode (multithreaded) and write the frames itself. Both produce the same directory and frame names. Defaults to "opencv"
+    :param output_format: "png" to write every frame as a PNG file, or "frame_store" to write raw frame chunks readable with frame_store.open_frame_sequence (only with the "opencv" backend). Defaults to "png"
+    :return: Path to directory with extracted frames
     """
+    if backend not in ("opencv", "ffmpeg"):
+        raise ValueError(f"Unknown frame extraction backend {backend}")
+    if output_format not in ("png", "frame_store"):
+        raise ValueError(f"Unknown frame output format {output_format}")
+    if backend == "ffmpeg" and output_format != "png":
+        raise ValueError("The ffmpeg backend can only extract frames as PNG files")
+
     vidcap = cv2.VideoCapture(str(path_to_video))
     fps = int(vidcap.get(cv2.CAP_PROP_FPS))
 
     target_directory = target_directory.parents[0] / f"{target_directory.stem}_{fps}FPS"
     file_manager.create_directory(target_directory)
 
+    if backend == "ffmpeg":
+        vidcap.release()
+        _extract_frames_from_video_with_ffmpeg(
+            path_to_video, target_directory, frame_prefix
+        )
+        return target_directory
+
+    if number_of_workers > 1:
+        if _extract_frames_from_video_segments(
+            path_to_video,
+            target_directory,
+            frame_prefix,
+            number_of_workers,
+            output_format,
+            fps,
+        ):
+            vidcap.release()
+            return target_directory
+
+    # The frame count is only used to report progress, so it's read from
+    # the container instead of decoding the video an extra time
+    total_number_of_frames = count_video_frames(path_to_video)
+
+    print(
+        f"\nExtracting {total_number_of_frames} frames from {path_to_video} to {target_directory}..."
+    )
+    print(f"Video frame rate is {fps}")
+    frame_store_writer = None
+    if output_format == "frame_store":
+        frame_store_writer = frame_store.FrameStoreWriter(
+            target_directory, fps=fps, frame_prefix=frame_prefix
+        )
+    with tqdm.tqdm(total=total_number_of_frames) as progressbar:
+        _write_video_frames(
+            vidcap,
+            target_directory,
+            frame_prefix,
+            first_frame_index=0,
+            number_of_frames=None,
+            progressbar=progressbar,
+            frame_store_writer=frame_store_writer,
+        )
+    if frame_store_writer is not None:
+        frame_store_writer.close()
+
+    return target_directory
+
+
+def _write_video_frames(
+    vidcap,
+    target_directory,
+    frame_prefix,
+    first_frame_index,
+    number_of_frames,
+    progressbar=None,
+    frame_store_writer=None,
+):
     count = 0
+    # PNG encoding runs in background threads while the next frames are decoded
+    with image_editor.async_img_writing():
+        while number_of_frames is None or count < number_of_frames:
+            frame_exists, image = vidcap.read()
+            if not frame_exists:
+                break
+            if frame_store_writer is not None:
+                frame_store_writer.append(image)
+            else:
+                image_editor.save_img(
+                    img=image,
+                    target_file_name=f"{f'{frame_prefix}_' if frame_prefix else ''}{str(first_frame_index + count).zfill(8)}",
+                    target_directory=target_directory,
+                    overwrite=True,
+                )
+            count += 1
+            if progressbar is not None:
+                progressbar.update(1)
+    return count
+
+
+def _extract_frames_from_video_with_ffmpeg(
+    path_to_video, target_directory, frame_prefix
+):
+    total_number_of_frames = count_video_frames(path_to_video)
+    print(
+        f"\nExtracting {total_number_of_frames} frames from {path_to_video} to {target_directory} with FFMPEG..."
+    )
+    # Same naming as the OpenCV backend, % is escaped for the image2 muxer pattern
+    escaped_frame_prefix = frame_prefix.replace("%", "%%")
+    frame_path_pattern = (
+        target_directory
+        / f"{f'{escaped_frame_prefix}_' if frame_prefix else ''}%08d.png"
+    )
+    ffmpeg_process = subprocess.Popen(
+        [
+            _ffmpeg_path,
+            "-v",
+            "error",
+            "-nostdin",
+            "-y",
+            "-i",
+            str(path_to_video),
+            "-map",
+            "0:v:0",
+            # Write every decoded frame once, without frame rate driven duplicates or drops
+            "-vsync",
+            "passthrough",
+            "-start_number",
+            "0",
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            str(frame_path_pattern),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    with tqdm.tqdm(total=total_number_of_frames) as progressbar:
+        for progress_line in ffmpeg_process.stdout:
+            key, _, value = progress_line.strip().partition("=")
+            if key == "frame" and value.isdigit():
+                progressbar.update(int(value) - progressbar.n)
+    if ffmpeg_process.wait() != 0:
+        raise subprocess.CalledProcessError(
+            ffmpeg_process.returncode, ffmpeg_process.args
+        )
 
-    # Loop through the video to get the number of frames
-    total_number_of_frames = 0
-    while vidcap.isOpened():
-        frame_exists, _ = vidcap.read()
-        if frame_exists:
-            total_number_of_frames += 1
-        else:
-            break
 
-    vidcap = cv2.VideoCapture(str(path_to_video))
+def _extract_frames_from_video_segments(
+    path_to_video, target_directory, frame_prefix, number_of_workers, output_format, fps
+):
+    # Returns False, without leaving any frame behind, if the video must be extracted serially
+    list_of_packets = _probe_video_packets(path_to_video)
+    if not _has_constant_frame_rate(list_of_packets):
+        pr_red(
+            f"{path_to_video} has a variable frame rate, frames are extracted serially"
+        )
+        return False
+
+    total_number_of_frames = len(list_of_packets)
+    keyframe_indices = [
+        index
+        for index, (_, _, is_keyframe) in enumerate(list_of_packets)
+        if is_keyframe
+    ]
+    list_of_segments = _split_frames_in_keyframe_segments(
+        total_number_of_frames, keyframe_indices, number_of_workers
+    )
+    # Segments are seeked by the timestamp of their first frame, relative to the stream start
+    first_timestamp = list_of_packets[0][1]
 
     print(
-        f"\nExtracting {total_number_of_frames} frames from {path_to_video} to {target_directory}..."
+        f"\nExtracting {total_number_of_frames} frames from {path_to_video} to {target_directory} "
+        f"in {len(list_of_segments)} parallel segments..."
     )
-    print(f"Video frame rate is {fps}")
-    for _ in tqdm.tqdm(range(total_number_of_frames)):
-        file_name = (
-            target_directory
-            / f"{f'{frame_prefix}_' if frame_prefix else ''}{str(count).zfill(8)}.png"
+    number_of_extracted_frames = 0
+    with futures.ProcessPoolExecutor(max_workers=number_of_workers) as pool:
+        segment_jobs = [
+            pool.submit(
+                _extract_frame_segment,
+                path_to_video,
+                target_directory,
+                frame_prefix,
+                first_frame_index,
+                number_of_frames,
+                output_format,
+                list_of_packets[first_frame_index][1] - first_timestamp,
+            )
+            for first_frame_index, number_of_frames in list_of_segments
+        ]
+        list_of_chunks = []
+        list_of_written_files = []
+        frame_shape = dtype = None
+        all_segments_seeked = True
+        with tqdm.tqdm(total=total_number_of_frames) as progressbar:
+            for segment_job in futures.as_completed(segment_jobs):
+                segment_result = segment_job.result()
+                if segment_result is None:
+                    all_segments_seeked = False
+                    continue
+                (
+                    extracted_segment_frames,
+                    segment_chunks,
+                    segment_frame_shape,
+                    segment_dtype,
+                ) = segment_result
+                number_of_extracted_frames += extracted_segment_frames
+                list_of_chunks.extend(segment_chunks)
+                if segment_frame_shape is not None:
+                    frame_shape, dtype = segment_frame_shape, segment_dtype
+                progressbar.update(extracted_segment_frames)
+
+    if not all_segments_seeked:
+        pr_red(
+            f"Seeking {path_to_video} didn't land on the segment keyframes, frames are extracted serially"
+        )
+        # Frame files are overwritten by the serial extraction, chunks are named by segment
+        for chunk in list_of_chunks:
+            (target_directory / chunk["file_name"]).unlink()
+        return False
+
+    if output_format == "frame_store" and frame_shape is not None:
+        frame_store.write_frame_store_index(
+            target_directory,
+            frame_shape,
+            dtype,
+            list_of_chunks,
+            fps=fps,
+            frame_prefix=frame_prefix,
+        )
+
+    if number_of_extracted_frames != total_number_of_frames:
+        pr_red(
+            f"Warning, {number_of_extracted_frames} frames were extracted "
+            f"but the video has {total_number_of_frames} frames"
+        )
+    return True
+
+
+def _split_frames_in_keyframe_segments(
+    total_number_of_frames, keyframe_indices, number_of_segments
+):
+    # Segments must start on keyframes so every worker can seek and decode
+    # its first frame without depending on the previous segment
+    segment_starts = {0}
+    for segment in range(1, number_of_segments):
+        ideal_start = segment * total_number_of_frames // number_of_segments
+        keyframe_position = bisect.bisect_left(keyframe_indices, ideal_start)
+        if keyframe_position < len(keyframe_indices):
+            segment_starts.add(keyframe_indices[keyframe_position])
+    segment_starts = sorted(segment_starts)
+    segment_ends = segment_starts[1:] + [total_number_of_frames]
+    return [
+        (start, end - start)
+        for start, end in zip(segment_starts, segment_ends)
+        if end > start
+    ]
+
+
+def _extract_frame_segment(
+    path_to_video,
+    target_directory,
+    frame_prefix,
+    first_frame_index,
+    number_of_frames,
+    output_format,
+    first_frame_timestamp,
+):
+    vidcap = cv2.VideoCapture(str(path_to_video))
+    if first_frame_index > 0:
+        # OpenCV seeks through the nominal frame rate, check it landed on the segment keyframe
+        # before writing anything. Timestamps are compared within half a frame
+        vidcap.set(cv2.CAP_PROP_POS_MSEC, first_frame_timestamp * 1000)
+        frame_exists, image = vidcap.read()
+        decoded_timestamp = vidcap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if not frame_exists or abs(
+            decoded_timestamp - first_frame_timestamp
+        ) > 0.5 / vidcap.get(cv2.CAP_PROP_FPS):
+            vidcap.release()
+            return None
+        vidcap = _PushedBackFrameCapture(vidcap, image)
+    # Segments write their own chunks, the index is written once all of them are done
+    frame_store_writer = None
+    if output_format == "frame_store":
+        frame_store_writer = frame_store.FrameStoreWriter(
+            target_directory, first_frame_index=first_frame_index, write_index=False
+        )
+    number_of_written_frames = _write_video_frames(
+        vidcap,
+        target_directory,
+        frame_prefix,
+        first_frame_index,
+        number_of_frames,
+        frame_store_writer=frame_store_writer,
+    )
+    vidcap.release()
+    if frame_store_writer is None:
+        return number_of_written_frames, [], None, None
+    return (
+        number_of_written_frames,
+        frame_store_writer.close(),
+        frame_store_writer.frame_shape,
+        frame_store_writer.dtype,
+    )
+
+
+class _PushedBackFrameCapture:
+    # Video capture returning an already decoded frame before reading the next ones
+
+    def __init__(self, vidcap, first_frame):
+        self.vidcap = vidcap
+        self.first_frame = first_frame
+
+    def read(self):
+        if self.first_frame is not None:
+            first_frame, self.first_frame = self.first_frame, None
+            return True, first_frame
+        return self.vidcap.read()
+
+    def release(self):
+        self.vidcap.release()
+
+
+def _has_constant_frame_rate(list_of_packets):
+    # Frame durations may differ by one time base unit from timestamp rounding
+    list_of_pts = [pts for pts, _, _ in list_of_packets]
+    frame_durations = [
+        next_pts - pts for pts, next_pts in zip(list_of_pts, list_of_pts[1:])
+    ]
+    return not frame_durations or max(frame_durations) - min(frame_durations) <= 1
+
+
+def get_video_keyframe_indices(path_to_video):
+    """Find the keyframes of a video from its packet flags through ffprobe, without decoding any frame
+
+    :param path_to_video: Path to video
+    :return: Tuple (number_of_frames, sorted list of keyframe indices in presentation order)
+    """
+    list_of_packets = _probe_video_packets(path_to_video)
+    keyframe_indices = [
+        index
+        for index, (_, _, is_keyframe) in enumerate(list_of_packets)
+        if is_keyframe
+    ]
+    return len(list_of_packets), keyframe_indices
+
+
+def _probe_video_packets(path_to_video):
+    # Tuples (pts, timestamp in seconds, is_keyframe) of the video packets, in presentation order
+    ffprobe_output = subprocess.check_output(
+        [
+            _ffprobe_path,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts,pts_time,flags",
+            "-of",
+            "csv=p=0",
+            str(path_to_video),
+        ],
+        text=True,
+    )
+    list_of_packets = []
+    for line in ffprobe_output.splitlines():
+        pts, pts_time, flags = line.split(",")[:3]
+        if pts != "N/A":
+            list_of_packets.append((int(pts), float(pts_time), "K" in flags))
+    # Packets come in decoding order, frames are numbered in presentation order
+    list_of_packets.sort()
+    return list_of_packets
+
+
+def count_video_frames(path_to_video):
+    """Count video frames without decoding them. The count comes from the container metadata,
+    if it's missing, ffprobe counts the video packets instead
+
+    :param path_to_video: Path to video
+    :return: Number of frames
+    """
+    number_of_frames = probe_video(path_to_video)["frame_count"]
+    if number_of_frames:
+        return number_of_frames
+
+    return int(
+        subprocess.check_output(
+            [
+                _ffprobe_path,
+                "-v",
+                "error",
+                "-select_streams",
+                "v:0",
+                "-count_packets",
+                "-show_entries",
+                "stream=nb_read_packets",
+                "-of",
+                "default=nw=1:nk=1",
+                str(path_to_video),
+            ]
         )
-        _, image = vidcap.read()
-        cv2.imwrite(str(file_name), image)
-        count += 1
+    )
+
+
+class FfmpegVideoCapture:
+    """Drop-in replacement for cv2.VideoCapture decoding with FFMPEG into a raw BGR pipe. Frames can be
+    resampled to a target frame rate while they are decoded, without writing a converted video first.
+    Like OpenCV, FFMPEG rotates the frames upright from the video rotation metadata
+    """
+
+    def __init__(self, path_to_video, target_fps=None):
+        """
+        :param path_to_video: Path to video
+        :param target_fps: Frame rate to resample the video to, preserving its speed. If None, frames are read at the original frame rate. Defaults to None
+        """
+        video_properties = probe_video(path_to_video)
+        self.width, self.height = get_video_display_size(path_to_video)
+        if target_fps is None:
+            self.fps = video_properties["fps"]
+            self.number_of_frames = count_video_frames(path_to_video)
+        else:
+            self.fps = target_fps
+            self.number_of_frames = int(
+                round(video_properties["duration"] * target_fps)
+            )
+
+        # Without a target frame rate, every decoded frame is read once, without duplicates or drops
+        video_filter_options = (
+            ["-vsync", "passthrough"]
+            if target_fps is None
+            else ["-vf", f"fps={target_fps}"]
+        )
+        self.ffmpeg_process = subprocess.Popen(
+            [
+                _ffmpeg_path,
+                "-v",
+                "error",
+                "-nostdin",
+                "-i",
+                str(path_to_video),
+                "-map",
+                "0:v:0",
+                *video_filter_options,
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "bgr24",
+                "pipe:1",
+            ],
+            stdout=subprocess.PIPE,
+        )
+
+    def isOpened(self):
+        return not self.ffmpeg_process.stdout.closed
+
+    def read(self, image=None):
+        """Read the next frame
+
+        :param image: Optional (H, W, 3) uint8 array to decode the frame into, defaults to None
+        :return: Tuple (frame_exists, frame)
+        """
+        if image is None:
+            image = numpy.empty((self.height, self.width, 3), dtype=numpy.uint8)
+        frame_buffer = memoryview(image).cast("B")
+        number_of_read_bytes = 0
+        while number_of_read_bytes < len(frame_buffer):
+            read_bytes = self.ffmpeg_process.stdout.readinto(
+                frame_buffer[number_of_read_bytes:]
+            )
+            if not read_bytes:
+                # The pipe ends when FFMPEG exits, which may be a decoding failure
+                self.ffmpeg_process.stdout.close()
+                self._check_ffmpeg_exit()
+                return False, None
+            number_of_read_bytes += read_bytes
+        return True, image
+
+    def get(self, property_id):
+        return {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_COUNT: self.number_of_frames,
+        }.get(property_id, 0)
+
+    def release(self):
+        if self.ffmpeg_process.stdout.closed:
+            # Read to the end, the exit status was already checked
+            return
+        # Stop FFMPEG in case the video wasn't read to the end
+        if self.ffmpeg_process.poll() is None:
+            self.ffmpeg_process.kill()
+            self.ffmpeg_process.stdout.close()
+            self.ffmpeg_process.wait()
+            return
+        self.ffmpeg_process.stdout.close()
+        self._check_ffmpeg_exit()
+
+    def _check_ffmpeg_exit(self):
+        if self.ffmpeg_process.wait() != 0:
+            raise subprocess.CalledProcessError(
+                self.ffmpeg_process.returncode, self.ffmpeg_process.args
+            )
+
+
+def iter_video_frame_stacks(vidcap, stack_size=_default_frame_stack_size):
+    """Read video frames in chunks, decoding them straight into a reused (N, H, W, 3) frame stack.
+    Every yielded stack is overwritten by the next one, consume it before moving on
+
+    :param vidcap: cv2.VideoCapture or FfmpegVideoCapture instance
+    :param stack_size: Maximum number of frames per stack, defaults to _default_frame_stack_size
+    :return: Generator of BGR frame stacks, the last one might hold fewer frames
+    """
+    frame_stack = None
+    while True:
+        frame_exists, frame = vidcap.read()
+        if not frame_exists:
+            return
+        if frame_stack is None:
+            frame_stack = numpy.empty((stack_size, *frame.shape), dtype=frame.dtype)
+        frame_stack[0] = frame
+        number_of_frames = 1
+        while number_of_frames < stack_size:
+            frame_exists, _ = vidcap.read(frame_stack[number_of_frames])
+            if not frame_exists:
+                break
+            number_of_frames += 1
+
+        yield frame_stack[:number_of_frames]
+        if number_of_frames < stack_size:
+            return
 
 
 def cleanup_tmp_dir():
@@ -165,22 +896,112 @@ def convert_video_frame_rate(
     return output_video_path
 
 
-def get_video_length_in_sec(path_to_video):
-    """Get video duration in seconds
+def probe_video(path_to_video):
+    """Get the properties of the first video stream with a single ffprobe call. Results are cached in
+    memory and on disk, invalidated when the file size or modification time change, so a video is only
+    probed again after it changes
 
     :param path_to_video: Path to video
-    :return: Video duration in seconds (float)
+    :return: Dict with keys width and height (coded size, before rotation), rotation (clockwise degrees to display the video upright, 0, 90, 180 or 270), duration (seconds), fps, frame_count (None if the container doesn't store it), codec and pix_fmt
     """
-    video_length = float(
+    path_to_video = Path(path_to_video).resolve()
+    file_stat = path_to_video.stat()
+    cache_key = (str(path_to_video), file_stat.st_size, file_stat.st_mtime_ns)
+
+    with _video_probes_lock:
+        video_properties = _video_probes.get(cache_key)
+    if video_properties is not None:
+        return video_properties
+
+    probe_cache_path = _video_probes_dir_pathlib / (
+        hashlib.sha1(str(path_to_video).encode("utf-8")).hexdigest() + ".json"
+    )
+    try:
+        with open(probe_cache_path) as probe_cache_file:
+            probe_cache = json.load(probe_cache_file)
+        if (
+            probe_cache["version"] == _video_probe_cache_version
+            and (probe_cache["file_size"], probe_cache["mtime_ns"]) == cache_key[1:]
+        ):
+            video_properties = probe_cache["video_properties"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if video_properties is None:
+        video_properties = _run_video_probe(path_to_video)
+        _write_probe_cache(
+            probe_cache_path,
+            {
+                "version": _video_probe_cache_version,
+                "file_size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+                "video_properties": video_properties,
+            },
+        )
+
+    with _video_probes_lock:
+        _video_probes[cache_key] = video_properties
+    return video_properties
+
+
+def _run_video_probe(path_to_video):
+    ffprobe_output = json.loads(
         subprocess.check_output(
             [
-                f"{_ffprobe_path} -v error -select_streams v:0 -show_entries stream=duration -of default=nw=1:nk=1 '{path_to_video}'"
-            ],
-            shell=True,
+                _ffprobe_path,
+                "-v",
+                "error",
+                "-select_streams",
+                "v:0",
+                "-show_entries",
+                "stream=width,height,codec_name,pix_fmt,avg_frame_rate,r_frame_rate,nb_frames,duration"
+                ":stream_tags=rotate:stream_side_data=rotation:format=duration",
+                "-of",
+                "json",
+                str(path_to_video),
+            ]
         )
     )
+    stream = ffprobe_output["streams"][0]
+
+    # Streams in some containers (e.g. Matroska) have no duration or frame count of their own
+    duration = stream.get("duration", ffprobe_output["format"].get("duration"))
+    frame_rate = stream.get("avg_frame_rate", "0/0")
+    if frame_rate.endswith("/0"):
+        frame_rate = stream.get("r_frame_rate", "0/1")
+    frame_count = stream.get("nb_frames")
+    # Older FFMPEG versions report the rotation as a tag, newer ones as a display matrix
+    rotation = stream.get("tags", {}).get("rotate", 0)
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "rotation": int(float(rotation)) % 360,
+        "duration": float(duration) if duration is not None else None,
+        "fps": float(fractions.Fraction(frame_rate)),
+        "frame_count": int(frame_count) if frame_count is not None else None,
+        "codec": stream.get("codec_name"),
+        "pix_fmt": stream.get("pix_fmt"),
+    }
+
+
+def _write_probe_cache(probe_cache_path, probe_cache):
+    try:
+        directory_index.write_json_file_atomically(probe_cache_path, probe_cache)
+    except OSError:
+        # The cache only saves ffprobe calls, probing still works without it
+        pass
 
-    return video_length
+
+def get_video_length_in_sec(path_to_video):
+    """Get video duration in seconds
+
+    :param path_to_video: Path to video
+    :return: Video duration in seconds (float)
+    """
+    return probe_video(path_to_video)["duration"]
 
 
 def get_video_size(path_to_video):
@@ -189,23 +1010,20 @@ def get_video_size(path_to_video):
     :param path_to_video: Path to video
     :return: Tuple (video_w, video_h) in pixels
     """
-    video_w = int(
-        subprocess.check_output(
-            [
-                f"{_ffprobe_path} -v error -show_entries stream=width -of default=nw=1:nk=1 '{path_to_video}'"
-            ],
-            shell=True,
-        )
-    )
-    video_h = int(
-        subprocess.check_output(
-            [
-                f"{_ffprobe_path} -v error -show_entries stream=height -of default=nw=1:nk=1 '{path_to_video}'"
-            ],
-            shell=True,
-        )
-    )
-    return video_w, video_h
+    video_properties = probe_video(path_to_video)
+    return video_properties["width"], video_properties["height"]
+
+
+def get_video_display_size(path_to_video):
+    """Get the size of the video frames once rotated upright, as FFMPEG and OpenCV decode them
+
+    :param path_to_video: Path to video
+    :return: Tuple (video_w, video_h) in pixels
+    """
+    video_properties = probe_video(path_to_video)
+    if video_properties["rotation"] in (90, 270):
+        return video_properties["height"], video_properties["width"]
+    return video_properties["width"], video_properties["height"]
 
 
 def crop_video(
@@ -220,16 +1038,238 @@ def crop_video(
     :param target_height: Target final video height
     :param x: X coordinate for top left corner for cropping box
     :param y: y coordinate for top left corner for cropping box
+    :return: Path to cropped video
+    """
+    return crop_video_regions(
+        path_to_video,
+        target_directory,
+        [(target_filename, target_width, target_height, x, y)],
+    )[0]
+
+
+def crop_video_regions(path_to_video, target_directory, list_of_regions):
+    """Crop several regions of a video decoding it only once. The decoded frames are split
+    to one crop filter and one encoder per region
+
+    :param path_to_video: Path to video
+    :param target_directory: Target directory to store cropped videos
+    :param list_of_regions: List of tuples (target_filename, target_width, target_height, x, y), x and y being the top left corner of the cropping box
+    :return: List of paths to cropped videos, in the order of the regions
     """
-    target_file_path = file_manager.find_new_unique_file_path(
-        target_file_path=target_directory / f"{target_filename}.mp4"
+    number_of_regions = len(list_of_regions)
+    ffmpeg_complex_filter = f"[0:v]split={number_of_regions}" + "".join(
+        f"[region{i}]" for i in range(number_of_regions)
     )
-    ffmpeg_crop_str = f"crop={target_width}:{target_height}:{x}:{y}"
-    subprocess.check_output(
+    ffmpeg_outputs = []
+    list_of_target_file_paths = []
+    try:
+        for i, (target_filename, target_width, target_height, x, y) in enumerate(
+            list_of_regions
+        ):
+            ffmpeg_complex_filter += (
+                f";[region{i}]crop={target_width}:{target_height}:{x}:{y}[crop{i}]"
+            )
+            target_file_path = directory_index.reserve_unique_file_path(
+                target_directory / f"{target_filename}.mp4"
+            )
+            list_of_target_file_paths.append(target_file_path)
+            # Audio, if any, goes to every cropped video
+            ffmpeg_outputs += [
+                "-map",
+                f"[crop{i}]",
+                "-map",
+                "0:a?",
+                str(target_file_path),
+            ]
+
+        subprocess.check_output(
+            [
+                _ffmpeg_path,
+                "-y",
+                "-i",
+                str(path_to_video),
+                "-filter_complex",
+                ffmpeg_complex_filter,
+                *ffmpeg_outputs,
+            ]
+        )
+    except BaseException:
+        for target_file_path in list_of_target_file_paths:
+            directory_index.release_reserved_file_path(target_file_path)
+        raise
+    return list_of_target_file_paths
+
+
+def create_video_contact_sheet(
+    path_to_video,
+    target_directory,
+    target_filename=None,
+    seconds_between_thumbnails=None,
+    max_number_of_thumbnails=_default_contact_sheet_max_thumbnails,
+    thumbnail_width=_default_contact_sheet_thumbnail_width,
+    number_of_columns=_default_contact_sheet_columns,
+    img_format="jpg",
+):
+    """Create a contact sheet previewing a video, a grid of timestamped thumbnails spread over the whole video.
+    Only the frames in the sheet are decoded, and FFMPEG downscales them while decoding
+
+    :param path_to_video: Path to video
+    :param target_directory: Target directory to store the contact sheet
+    :param target_filename: Target name for the contact sheet, if None, the video name is used. Defaults to None
+    :param seconds_between_thumbnails: Seconds between thumbnails, every thumbnail is found by seeking. If None, thumbnails are taken from keyframes only, decoded in a single pass, unless the video has less than half max_number_of_thumbnails keyframes to pick from. Defaults to None
+    :param max_number_of_thumbnails: Maximum number of thumbnails, they are spread further apart on long videos, defaults to _default_contact_sheet_max_thumbnails
+    :param thumbnail_width: Thumbnail width in pixels, defaults to _default_contact_sheet_thumbnail_width
+    :param number_of_columns: Number of thumbnails per row, defaults to _default_contact_sheet_columns
+    :param img_format: Target file format, defaults to "jpg"
+    :return: Path to contact sheet, or None if no frame could be decoded
+    """
+    path_to_video = Path(path_to_video)
+    video_properties = probe_video(path_to_video)
+    # Thumbnails are decoded upright, as the video is displayed
+    video_w, video_h = get_video_display_size(path_to_video)
+    thumbnail_height = max(2, int(round(thumbnail_width * video_h / video_w)))
+    thumbnail_size = (thumbnail_width, thumbnail_height)
+    # Spread the thumbnails over the whole video if there are too many of them
+    min_seconds_between_thumbnails = (
+        video_properties["duration"] / max_number_of_thumbnails
+    )
+
+    list_of_thumbnails = []
+    if seconds_between_thumbnails is None:
+        list_of_thumbnails = _read_keyframe_thumbnails(
+            path_to_video, thumbnail_size, min_seconds_between_thumbnails
+        )
+        # Videos with few keyframes, e.g. a single GOP, are sampled by seeking instead
+        if len(list_of_thumbnails) < max_number_of_thumbnails // 2:
+            seconds_between_thumbnails = min_seconds_between_thumbnails
+
+    if seconds_between_thumbnails is not None:
+        seconds_between_thumbnails = max(
+            seconds_between_thumbnails, min_seconds_between_thumbnails
+        )
+        list_of_thumbnails = []
+        timestamp = 0
+        while timestamp < video_properties["duration"]:
+            list_of_thumbnails += _read_keyframe_thumbnails(
+                path_to_video, thumbnail_size, seek=timestamp
+            )
+            timestamp += seconds_between_thumbnails
+    list_of_thumbnails = list_of_thumbnails[:max_number_of_thumbnails]
+
+    if not list_of_thumbnails:
+        pr_red(f"Warning, no frames could be decoded from {path_to_video}")
+        return None
+
+    number_of_columns = min(number_of_columns, len(list_of_thumbnails))
+    number_of_rows = -(-len(list_of_thumbnails) // number_of_columns)
+    contact_sheet = numpy.zeros(
+        (
+            number_of_rows * thumbnail_height,
+            number_of_columns * thumbnail_width,
+            3,
+        ),
+        dtype=numpy.uint8,
+    )
+    for i, thumbnail in enumerate(list_of_thumbnails):
+        row, column = divmod(i, number_of_columns)
+        image_editor.paste_img(
+            main_img=contact_sheet,
+            img_to_paste=thumbnail,
+            position=(column * thumbnail_width, row * thumbnail_height),
+            anchor_point="top_left",
+        )
+
+    if target_filename is None:
+        target_filename = f"{path_to_video.stem}_contact_sheet"
+    return image_editor.save_img(
+        img=contact_sheet,
+        target_file_name=target_filename,
+        target_directory=Path(target_directory),
+        img_format=img_format,
+    )
+
+
+def create_video_contact_sheets(
+    list_of_paths_to_videos, target_directory, number_of_workers=None, **kwargs
+):
+    """Create a contact sheet for every video in a list. Videos are processed concurrently,
+    every one of them by its own FFMPEG processes
+
+    :param list_of_paths_to_videos: List of paths to videos
+    :param target_directory: Target directory to store the contact sheets
+    :param number_of_workers: Number of videos processed at the same time, if None, the number of CPUs is used. Defaults to None
+    :param kwargs: Keyword arguments passed to create_video_contact_sheet
+    :return: List of paths to contact sheets, in the order of the videos
+    """
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+    with futures.ThreadPoolExecutor(max_workers=number_of_workers) as pool:
+        return list(
+            tqdm.tqdm(
+                pool.map(
+                    lambda path_to_video: create_video_contact_sheet(
+                        path_to_video, target_directory, **kwargs
+                    ),
+                    list_of_paths_to_videos,
+                ),
+                total=len(list_of_paths_to_videos),
+            )
+        )
+
+
+def _read_keyframe_thumbnails(
+    path_to_video, thumbnail_size, min_seconds_between_thumbnails=0, seek=None
+):
+    # Without a seek, non-keyframes are skipped by the decoder and keyframes are further selected
+    # by their spacing. With a seek, only the first frame from the seek position is decoded.
+    # Timestamps are drawn by FFMPEG, as the raw frames don't carry them
+    thumbnail_width, thumbnail_height = thumbnail_size
+    timestamp_height = int(thumbnail_height * _default_subtitle_height_percentage * 2)
+    video_filter = (
+        f"scale={thumbnail_width}:{thumbnail_height},setsar=1,"
+        f"drawtext=fontfile={_default_font_path}:text='%{{pts\\:hms}}':fontcolor=white:"
+        f"fontsize={timestamp_height}:box=1:boxcolor=black:x=0:y=0"
+    )
+    if seek is None:
+        decoding_options = ["-skip_frame", "nokey"]
+        video_filter = (
+            f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{min_seconds_between_thumbnails:.6f})',"
+            + video_filter
+        )
+        output_options = []
+    else:
+        decoding_options = ["-ss", f"{seek:.6f}", "-copyts"]
+        output_options = ["-frames:v", "1"]
+
+    ffmpeg_output = subprocess.check_output(
         [
-            f"{_ffmpeg_path} -i {path_to_video} -filter:v '{ffmpeg_crop_str}' '{target_file_path}'"
-        ],
-        shell=True,
+            _ffmpeg_path,
+            "-v",
+            "error",
+            "-nostdin",
+            *decoding_options,
+            "-i",
+            str(path_to_video),
+            "-map",
+            "0:v:0",
+            "-vf",
+            video_filter,
+            "-vsync",
+            "passthrough",
+            *output_options,
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "pipe:1",
+        ]
+    )
+    thumbnails = numpy.frombuffer(ffmpeg_output, dtype=numpy.uint8)
+    thumbnail_number_of_bytes = thumbnail_width * thumbnail_height * 3
+    return list(
+        thumbnails[
+            : len(thumbnails) // thumbnail_number_of_bytes * thumbnail_number_of_bytes
+        ].reshape(-1, thumbnail_height, thumbnail_width, 3)
     )
 
 
@@ -242,6 +1282,7 @@ def stitch_list_of_videos_side_by_side(
     insert_timers,
     list_of_subtitles,
     remove_audio,
+    number_of_segments=1,
 ):
     """Create a video composition of side by side videos. The script will construct and execute necessary FFMPEG command line program
 
@@ -253,204 +1294,357 @@ def stitch_list_of_videos_side_by_side(
     :param insert_timers: Insert a timer at the top-left side of every video
     :param list_of_subtitles: List of subtitles to set below every video
     :param remove_audio: Remove audio from final composition
+    :param number_of_segments: Number of timeline segments rendered by parallel FFMPEG processes and joined without re-encoding. Audio is rendered once for the whole timeline. Defaults to 1
+    :return: Path to video composition
     """
-    max_duration = 0
-    duration_list = []
-    ffmpeg_input_videos = ""
-    # Final composition height is based on first video size
-    _, final_video_h = get_video_size(list_of_paths_to_videos[0])
+    # Collect the video lenghts to properly trim and cut composition
+    list_of_durations = [
+        get_video_length_in_sec(video_path) for video_path in list_of_paths_to_videos
+    ]
+    composition_duration = (
+        max(list_of_durations) + last_frame_freeze_duration / slow_mo_factor
+    )
+    # The composition has the frame rate of the first video, so segments can be cut at frame boundaries
+    composition_fps = probe_video(list_of_paths_to_videos[0])["fps"]
+    number_of_composition_frames = int(round(composition_duration * composition_fps))
 
-    # Examine input videos
-    for video_path in list_of_paths_to_videos:
-        # Construct FFMPEG command for input videos
-        ffmpeg_input_videos += f"-i '{video_path}' "
-        # Collect the video lenghts to properly trim and cut composition
-        vid_duration = get_video_length_in_sec(video_path)
-        duration_list.append(vid_duration)
-        max_duration = (
-            max(max_duration, vid_duration)
-            + last_frame_freeze_duration / slow_mo_factor
+    if not remove_audio and slow_mo_factor > 2:
+        pr_red(
+            "Warning, slow mo factor is greater than two, audio will be removed since it's not possible to slow down >2"
         )
+        remove_audio = True
+
+    target_file_path = directory_index.reserve_unique_file_path(
+        target_directory / f"{target_filename}.mp4"
+    )
+    try:
+        if number_of_segments <= 1:
+            ffmpeg_inputs, ffmpeg_complex_filter = _build_side_by_side_filter(
+                list_of_paths_to_videos,
+                list_of_durations,
+                list_of_subtitles,
+                insert_timers,
+                slow_mo_factor,
+                composition_fps,
+                first_frame_index=0,
+                number_of_frames=number_of_composition_frames,
+            )
+            ffmpeg_output_options = [
+                "-map",
+                "[video]",
+                "-frames:v",
+                str(number_of_composition_frames),
+            ]
+            if remove_audio:
+                ffmpeg_output_options.append("-an")
+            else:
+                ffmpeg_complex_filter += f";{_build_audio_mix_filter(len(list_of_paths_to_videos), slow_mo_factor)}"
+                # -ac 2 to downmix audio to stereo
+                ffmpeg_output_options += ["-map", "[audio]", "-ac", "2"]
+            subprocess.check_output(
+                [
+                    _ffmpeg_path,
+                    "-y",
+                    *ffmpeg_inputs,
+                    "-filter_complex",
+                    ffmpeg_complex_filter,
+                    *ffmpeg_output_options,
+                    "-vsync",
+                    "0",
+                    str(target_file_path),
+                ]
+            )
+        else:
+            _stitch_timeline_segments_in_parallel(
+                list_of_paths_to_videos,
+                list_of_durations,
+                list_of_subtitles,
+                insert_timers,
+                slow_mo_factor,
+                remove_audio,
+                composition_fps,
+                number_of_composition_frames,
+                number_of_segments,
+                target_file_path,
+            )
+    except BaseException:
+        directory_index.release_reserved_file_path(target_file_path)
+        raise
+    return target_file_path
 
-    # The following actions are done by constructing FFMPEG complex filters
+
+def _stitch_timeline_segments_in_parallel(
+    list_of_paths_to_videos,
+    list_of_durations,
+    list_of_subtitles,
+    insert_timers,
+    slow_mo_factor,
+    remove_audio,
+    composition_fps,
+    number_of_composition_frames,
+    number_of_segments,
+    target_file_path,
+):
+    file_manager.create_directory(_tmp_dir_pathlib)
+    segment_boundaries = [
+        int(round(k * number_of_composition_frames / number_of_segments))
+        for k in range(number_of_segments + 1)
+    ]
+    list_of_segment_paths = [
+        _tmp_dir_pathlib / f"{target_file_path.stem}_segment_{str(k).zfill(4)}.mp4"
+        for k in range(number_of_segments)
+    ]
+    audio_path = _tmp_dir_pathlib / f"{target_file_path.stem}_audio.m4a"
+    concat_list_path = _tmp_dir_pathlib / f"{target_file_path.stem}_segments.txt"
+
+    print(
+        f"\nStitching {len(list_of_paths_to_videos)} videos in {number_of_segments} parallel segments..."
+    )
+    with futures.ThreadPoolExecutor(max_workers=number_of_segments) as pool:
+        segment_jobs = [
+            pool.submit(
+                _render_side_by_side_segment,
+                list_of_paths_to_videos,
+                list_of_durations,
+                list_of_subtitles,
+                insert_timers,
+                slow_mo_factor,
+                composition_fps,
+                segment_boundaries[k],
+                segment_boundaries[k + 1] - segment_boundaries[k],
+                segment_path,
+            )
+            for k, segment_path in enumerate(list_of_segment_paths)
+        ]
+        if not remove_audio:
+            segment_jobs.append(
+                pool.submit(
+                    _render_audio_mix,
+                    list_of_paths_to_videos,
+                    slow_mo_factor,
+                    audio_path,
+                )
+            )
+        for segment_job in tqdm.tqdm(
+            futures.as_completed(segment_jobs), total=len(segment_jobs)
+        ):
+            segment_job.result()
+
+    # Exact segment durations, the ones in the MP4 headers can fall short by a few frames
+    with open(concat_list_path, "w") as concat_list_file:
+        for k, segment_path in enumerate(list_of_segment_paths):
+            escaped_segment_path = str(segment_path).replace("'", "'\\''")
+            segment_duration = (
+                (segment_boundaries[k + 1] - segment_boundaries[k])
+                * slow_mo_factor
+                / composition_fps
+            )
+            concat_list_file.write(
+                f"file '{escaped_segment_path}'\nduration {segment_duration:.6f}\n"
+            )
+
+    ffmpeg_audio_input, ffmpeg_audio_map = [], []
+    if not remove_audio:
+        ffmpeg_audio_input = ["-i", str(audio_path)]
+        ffmpeg_audio_map = ["-map", "1:a"]
+    # Video is mapped first, so the streams are ordered as in a single-segment composition
+    subprocess.check_output(
+        [
+            _ffmpeg_path,
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            str(concat_list_path),
+            *ffmpeg_audio_input,
+            "-map",
+            "0:v",
+            *ffmpeg_audio_map,
+            "-c",
+            "copy",
+            str(target_file_path),
+        ]
+    )
+
+    for tmp_file_path in [*list_of_segment_paths, audio_path, concat_list_path]:
+        tmp_file_path.unlink(missing_ok=True)
+
+
+def _render_side_by_side_segment(
+    list_of_paths_to_videos,
+    list_of_durations,
+    list_of_subtitles,
+    insert_timers,
+    slow_mo_factor,
+    composition_fps,
+    first_frame_index,
+    number_of_frames,
+    segment_path,
+):
+    ffmpeg_inputs, ffmpeg_complex_filter = _build_side_by_side_filter(
+        list_of_paths_to_videos,
+        list_of_durations,
+        list_of_subtitles,
+        insert_timers,
+        slow_mo_factor,
+        composition_fps,
+        first_frame_index,
+        number_of_frames,
+    )
+    subprocess.check_output(
+        [
+            _ffmpeg_path,
+            "-y",
+            "-v",
+            "error",
+            *ffmpeg_inputs,
+            "-filter_complex",
+            ffmpeg_complex_filter,
+            "-map",
+            "[video]",
+            "-frames:v",
+            str(number_of_frames),
+            "-an",
+            "-vsync",
+            "0",
+            str(segment_path),
+        ]
+    )
+
+
+def _render_audio_mix(list_of_paths_to_videos, slow_mo_factor, audio_path):
+    ffmpeg_inputs = []
+    for video_path in list_of_paths_to_videos:
+        ffmpeg_inputs += ["-i", str(video_path)]
+    subprocess.check_output(
+        [
+            _ffmpeg_path,
+            "-y",
+            "-v",
+            "error",
+            *ffmpeg_inputs,
+            "-filter_complex",
+            _build_audio_mix_filter(len(list_of_paths_to_videos), slow_mo_factor),
+            "-map",
+            "[audio]",
+            # -ac 2 to downmix audio to stereo
+            "-ac",
+            "2",
+            str(audio_path),
+        ]
+    )
+
+
+def _build_audio_mix_filter(number_of_videos, slow_mo_factor):
+    audio_inputs = "".join(f"[{i}:a]" for i in range(number_of_videos))
+    return f"{audio_inputs}amix=inputs={number_of_videos},atempo={float(1 / slow_mo_factor)}[audio]"
+
+
+def _build_side_by_side_filter(
+    list_of_paths_to_videos,
+    list_of_durations,
+    list_of_subtitles,
+    insert_timers,
+    slow_mo_factor,
+    composition_fps,
+    first_frame_index,
+    number_of_frames,
+):
+    """Build the FFMPEG inputs and complex filter composing a segment of frames of the side by side video.
+    Every input is seeked to the segment start, cut to the segment duration and resampled to the
+    composition frame rate. Inputs shorter than the segment keep showing their last frame
+
+    :return: Tuple (list of FFMPEG input arguments, complex filter with output [video])
+    """
+    number_of_videos = len(list_of_paths_to_videos)
+    segment_start = first_frame_index / composition_fps
+    ffmpeg_inputs = []
     ffmpeg_complex_filter = ""
 
-    # Video scaling
-    for i in range(len(list_of_paths_to_videos)):
-        # All videos must be scaled to match first input video height
-        ffmpeg_complex_filter += f"[{i}:v]scale=-1:{final_video_h}[v{i}];"
-        if insert_timers:
-            # Scale and set durations for timers
-            timer_height = int(final_video_h * _default_subtitle_height_percentage)
-            ffmpeg_input_videos += f" -i '{_1_minute_timer_video_path}'"
-            ffmpeg_complex_filter += f"[{len(list_of_paths_to_videos) + i}:v]scale=-1:{timer_height}[timer{i}];[timer{i}]trim=duration={duration_list[i]}[timer{i}];"
+    # Final composition height is based on first video size
+    _, final_video_h = get_video_size(list_of_paths_to_videos[0])
+    # All videos must be scaled to match first input video height,
+    # keeping even widths for yuv420p encoding
+    list_of_video_widths = []
+    for video_path in list_of_paths_to_videos:
+        input_video_w, input_video_h = get_video_size(video_path)
+        list_of_video_widths.append(
+            2 * int(round(input_video_w / input_video_h * final_video_h / 2))
+        )
 
-    # Construct the horizontal video stack layout with padding inbetween videos
+    # Timers show the timestamp of every input frame. They are drawn before the last frame
+    # is cloned, so they stop when their video ends, and before slowing down, so they show real time
+    timer_height = int(final_video_h * _default_subtitle_height_percentage)
+    timer_filter = f",drawtext=fontfile={_default_font_path}:text='%{{pts\\:hms}}':fontcolor=white:fontsize={timer_height}:box=1:boxcolor=black:x=0:y=0"
+
+    # Video scaling, with padding inbetween videos. Timestamps of seeked inputs start at 0 from the
+    # seek position, they are moved back to the input timeline
     padding_width = 20
-    ffmpeg_stack_filter = ""
-    for i in range(len(list_of_paths_to_videos) - 1):
-        ffmpeg_complex_filter += f"color=black:{padding_width}x{final_video_h}:d={max_duration}[blackpad{i}];"
-        ffmpeg_stack_filter += f"[v{i}][blackpad{i}]"
-    i += 1
-    ffmpeg_stack_filter += (
-        f"[v{i}]hstack=inputs={len(list_of_paths_to_videos)*2-1}[composition];"
-    )
-    ffmpeg_complex_filter += ffmpeg_stack_filter
+    for i, (video_path, video_duration) in enumerate(
+        zip(list_of_paths_to_videos, list_of_durations)
+    ):
+        seek = _get_segment_seek(video_duration, segment_start)
+        ffmpeg_inputs += _get_seeked_input(video_path, seek)
+        ffmpeg_complex_filter += f"[{i}:v]setpts=PTS+{seek:.6f}/TB,scale={list_of_video_widths[i]}:{final_video_h},setsar=1"
+        if insert_timers:
+            ffmpeg_complex_filter += timer_filter
+        ffmpeg_complex_filter += f",{_build_segment_trim_filter(seek, first_frame_index, number_of_frames, composition_fps)}"
+        if i < number_of_videos - 1:
+            ffmpeg_complex_filter += f",pad=iw+{padding_width}:ih:0:0:black"
+        ffmpeg_complex_filter += f"[v{i}];"
+
+    # Construct the horizontal video stack layout
+    ffmpeg_complex_filter += "".join(f"[v{i}]" for i in range(number_of_videos))
+    if number_of_videos > 1:
+        ffmpeg_complex_filter += f"hstack=inputs={number_of_videos}[composition];"
+    else:
+        ffmpeg_complex_filter += "null[composition];"
 
     # Insert a black banner at the bottom of the composition and insert video subtitles
     # to identify every single input video
-
     text_box_opacity = 1.0
     text_height_percentage = _default_subtitle_height_percentage
     ffmpeg_complex_filter += f"[composition]drawbox=x=0:y=ih-h:w=iw:h=ih*{text_height_percentage}:color=black@{text_box_opacity}:t=fill"
     normalized_font_size = 1000
     for i, subtitle_text in enumerate(list_of_subtitles):
-        input_video_w, input_video_h = get_video_size(list_of_paths_to_videos[i])
-        # If input video had to be rescaled, find resulting w after scaling
-
-        subtitle_text = subtitle_text.replace(" ", "\ ")
-        if input_video_h != final_video_h:
-            input_video_w = input_video_w / input_video_h * final_video_h
         font_size = image_editor.find_best_font_size(
-            subtitle_text, input_video_w, text_height_percentage * final_video_h
+            subtitle_text,
+            list_of_video_widths[i],
+            text_height_percentage * final_video_h,
         )
         normalized_font_size = min(normalized_font_size, font_size)
     video_width_tracker = 0
     for i, subtitle_text in enumerate(list_of_subtitles):
-        subtitle_text = subtitle_text.replace(" ", "\ ")
-        ffmpeg_complex_filter += f",drawtext=fontfile={_default_font_path}:text='{subtitle_text}':fontcolor=white:fontsize={normalized_font_size}:x={video_width_tracker}+{input_video_w}/2-text_w/2:y=h-text_h-10"
-        video_width_tracker += input_video_w + padding_width
-
-    if insert_timers:
-        video_width_tracker = 0
-        for i in range(len(list_of_paths_to_videos) - 1):
-            ffmpeg_complex_filter += f"[composition];[composition][timer{i}]overlay={video_width_tracker}:{0}[composition]"
-
-            input_video_w, input_video_h = get_video_size(list_of_paths_to_videos[i])
-            video_width_tracker += input_video_w + padding_width
-        i += 1
-        ffmpeg_complex_filter += (
-            f";[composition][timer{i}]overlay={video_width_tracker}:{0}"
-        )
+        subtitle_text = subtitle_text.replace(" ", "\\ ")
+        ffmpeg_complex_filter += f",drawtext=fontfile={_default_font_path}:text='{subtitle_text}':fontcolor=white:fontsize={normalized_font_size}:x={video_width_tracker}+{list_of_video_widths[i]}/2-text_w/2:y=h-text_h-10"
+        video_width_tracker += list_of_video_widths[i] + padding_width
 
     # Slow down the final composition by x factor
-    ffmpeg_complex_filter += (
-        f"[composition];[composition]setpts={float(slow_mo_factor)}*PTS"
-    )
-    if not remove_audio:
-        if slow_mo_factor <= 2:
-            ffmpeg_complex_filter += f";amix=inputs={len(list_of_paths_to_videos)},atempo={float(1/slow_mo_factor)}"
-            audio_option = "-ac 2"
-    else:
-        pr_red(
-            "Warning, slow mo factor is greater than two, audio will be removed since it's not possible to slow down >2"
-        )
-        audio_option = "-an"
+    ffmpeg_complex_filter += f",setpts={float(slow_mo_factor)}*PTS[video]"
+    return ffmpeg_inputs, ffmpeg_complex_filter
 
-    target_file_path = file_manager.find_new_unique_file_path(
-        target_file_path=target_directory / f"{target_filename}.mp4"
-    )
-    # -ac 2 to downmix audio to stereo
-    subprocess.check_output(
-        [
-            f"{_ffmpeg_path} {ffmpeg_input_videos} -filter_complex '{ffmpeg_complex_filter}' {audio_option} -vsync 0 '{target_file_path}'"
-        ],
-        shell=True,
-    )
 
+def _get_segment_seek(input_duration, segment_start):
+    # Inputs are seeked a second before the segment start, or before their end if they are shorter,
+    # so the frames shown at the start of the segment are decoded
+    return max(0.0, min(segment_start, input_duration) - 1.0)
 
-# # function for combined two frames.
-# def stitch_video_frames_opencv(frame1, frame2, Video_w, Video_h, Video_w2, Video_h2):
-#     frame2 = cv2.resize(
-#         frame2, (int(Video_w2), int(Video_h)), interpolation=cv2.INTER_AREA
-#     )
-#     BG = cv2.resize(
-#         frame1, (int(Video_w + Video_w2), int(Video_h)), interpolation=cv2.INTER_AREA
-#     )
-#     BG[0 : int(Video_h), 0 : int(Video_w)] = frame1
-#     BG[0 : int(Video_h), int(Video_w) : int(Video_w + Video_w2)] = frame2
-#     return BG
-
-
-# def stitch_list_of_videos_side_by_side_opencv(
-#     list_of_paths_to_videos,
-#     target_filename,
-#     target_directory,
-#     fps,
-#     list_of_subtitles=None,
-# ):
-#     """Open CV version of the video stitching method. Much slower than the ffmpeg version but more readable
-
-#     :param list_of_paths_to_videos: List ot paths to videos to stitch together, sorted from left to right
-#     :param target_filename: Target name for the composition
-#     :param target_directory: Target directory to store video composition
-#     :param fps: Target frame rate for final video composition
-#     :param list_of_subtitles: List of subtitles to set below every video, defaults to None
-#     """
-#     target_file_path = file_manager.find_new_unique_file_path(
-#         target_file_path=target_directory / f"{target_filename}.mp4"
-#     )
-
-#     Video1 = list_of_paths_to_videos[0]
-#     Video2 = list_of_paths_to_videos[1]
-
-#     cap1 = cv2.VideoCapture(str(Video1))
-#     cap2 = cv2.VideoCapture(str(Video2))
-
-#     # fps_c = cap1.get(cv2.CAP_PROP_FPS)
-#     # fps_c2 = cap2.get(cv2.CAP_PROP_FPS)
-
-#     Video1 = convert_video_frame_rate(
-#         path_to_video=Video1,
-#         target_fps=_default_frame_rate,
-#         target_directory=target_directory,
-#         target_file_name=f"{Video1.stem}_{_default_frame_rate}fps{Video1.suffix}",
-#     )
-#     cap1 = cv2.VideoCapture(str(Video1))
-
-#     Video2 = convert_video_frame_rate(
-#         path_to_video=Video2,
-#         target_fps=_default_frame_rate,
-#         target_directory=target_directory,
-#         target_file_name=f"{Video2.stem}_{_default_frame_rate}fps{Video2.suffix}",
-#     )
-#     cap2 = cv2.VideoCapture(str(Video2))
-
-#     num_frames_vid1 = int(cap1.get(cv2.CAP_PROP_FRAME_COUNT))
-#     num_frames_vid2 = int(cap2.get(cv2.CAP_PROP_FRAME_COUNT))
-
-#     fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
-#     videowriter = None
-
-#     for i in tqdm.tqdm(range(max(num_frames_vid1, num_frames_vid2))):
-#         # ret, frame1 = cap1.read()
-#         # ret, frame2 = cap2.read()
-
-#         if i < num_frames_vid1:
-#             ret, frame1 = cap1.read()
-
-#         if i < num_frames_vid2:
-#             ret, frame2 = cap2.read()
-
-#         if i == (max(num_frames_vid1, num_frames_vid2)):
-#             break
-
-#         frame1pil = image_editor.convert_opencv_format_to_pil(frame1)
-#         frame2pil = image_editor.convert_opencv_format_to_pil(frame2)
-#         if list_of_subtitles:
-#             image_editor.insert_subtitle(img=frame1pil, text=list_of_subtitles[0])
-#             image_editor.insert_subtitle(img=frame2pil, text=list_of_subtitles[1])
-
-#         img = image_editor.stitch_images_side_by_side([frame1pil, frame2pil])
-#         if videowriter is None:
-#             size = img.size
-#             videowriter = cv2.VideoWriter(str(target_file_path), fourcc, fps, size)
-#         img = image_editor.convert_pil_to_opencv_format(img)
-
-#         videowriter.write(img)
-#         if cv2.waitKey(1) & 0xFF == ord("q"):
-#             cv2.destroyAllWindows()
-#             break
-
-#     # file_manager.move_file_to_trash(Video1)
-#     # file_manager.move_file_to_trash(Video2)
+
+def _get_seeked_input(video_path, seek):
+    if seek > 0:
+        return ["-ss", f"{seek:.6f}", "-i", str(video_path)]
+    return ["-i", str(video_path)]
+
+
+def _build_segment_trim_filter(seek, first_frame_index, number_of_frames, fps):
+    # Inputs on the composition timeline are extended with their last frame and resampled on the
+    # composition frame grid. Timestamps are then frame indices, so the segment is cut at exact frames
+    segment_end = (first_frame_index + number_of_frames) / fps
+    return (
+        f"tpad=stop_mode=clone:stop_duration={segment_end - seek:.6f},"
+        f"fps={fps},"
+        f"trim=start_pts={first_frame_index}:end_pts={first_frame_index + number_of_frames},"
+        "setpts=PTS-STARTPTS"
+    )